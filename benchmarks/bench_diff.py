@@ -0,0 +1,75 @@
+"""Microbenchmark: mce_tasks_djq.diff.make_patch vs jsonpatch.JsonPatch.from_diff
+
+python benchmarks/bench_diff.py [--number 200]
+
+The documents are built from tests/fixtures/resource-vm.json with the
+size of the to_dict() of a real VM (tags, network, disks, extensions).
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+
+import jsonpatch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from mce_tasks_djq.diff import make_patch  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures')
+
+
+def build_document():
+    with open(os.path.join(FIXTURES_DIR, 'resource-vm.json')) as fp:
+        resource = json.load(fp)
+
+    properties = resource['properties']
+    for i in range(16):
+        properties['storageProfile']['dataDisks'].append(dict(
+            lun=i, name=f"disk{i}", createOption="Attach", caching="None",
+            diskSizeGB=128, managedDisk=dict(id=f"{resource['id']}/disks/disk{i}", storageAccountType="Premium_LRS"),
+        ))
+    properties['extensions'] = {
+        f"ext{i}": dict(publisher="Microsoft.Azure", type=f"Extension{i}", settings={f"k{j}": j for j in range(20)})
+        for i in range(20)
+    }
+
+    return dict(
+        resource_id=resource['id'].lower(),
+        name=resource['name'],
+        location=resource['location'],
+        tags=[dict(name=f"tag{i}", value=f"value{i}") for i in range(30)],
+        metas=properties,
+    )
+
+
+def run(number):
+    old = build_document()
+
+    cases = {
+        'unchanged': copy.deepcopy(old),
+        'one nested field': copy.deepcopy(old),
+        'tags': copy.deepcopy(old),
+    }
+    cases['one nested field']['metas']['hardwareProfile']['vmSize'] = "Standard_D4s_v3"
+    cases['tags']['tags'].append(dict(name="new", value="tag"))
+
+    print(f"document size: {len(json.dumps(old))} bytes - {number} iterations\n")
+    print(f"{'case':<20}{'jsonpatch (ms)':>16}{'make_patch (ms)':>18}{'speedup':>10}")
+
+    for name, new in cases.items():
+        assert jsonpatch.apply_patch(old, make_patch(old, new)) == new
+
+        t_jsonpatch = timeit.timeit(lambda: list(jsonpatch.JsonPatch.from_diff(old, new)), number=number)
+        t_diff = timeit.timeit(lambda: make_patch(old, new), number=number)
+
+        print(f"{name:<20}{t_jsonpatch * 1000 / number:>16.3f}{t_diff * 1000 / number:>18.3f}{t_jsonpatch / t_diff:>9.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=200)
+    run(parser.parse_args().number)
@@ -0,0 +1,109 @@
+"""Adaptive sync intervals
+
+After each run, the minutes of the schedule of the subscription are
+increased when nothing changed and decreased when the run found at least
+MCE_ADAPTIVE_BUSY_CHANGES changes, between MCE_ADAPTIVE_MIN_MINUTES and
+MCE_ADAPTIVE_MAX_MINUTES. The interval is never shorter than twice the
+duration of the run.
+
+Every decision is logged and kept in the Django cache (get_decisions).
+"""
+
+import logging
+import math
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+from django_q.models import Schedule
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+DECISIONS_KEY = 'mce_tasks_djq:adaptive:decisions'
+
+
+def next_minutes(minutes, counters, duration):
+    """Return (new minutes, reason) for a run with counters and duration (seconds)"""
+
+    changes = sum(counters.get(k, 0) for k in ('created', 'updated', 'deleted'))
+
+    if changes == 0:
+        new_minutes, reason = minutes * get_setting('MCE_ADAPTIVE_INCREASE'), 'quiet'
+    elif changes >= get_setting('MCE_ADAPTIVE_BUSY_CHANGES'):
+        new_minutes, reason = minutes / get_setting('MCE_ADAPTIVE_DECREASE'), 'busy'
+    else:
+        new_minutes, reason = minutes, 'steady'
+
+    lower = max(get_setting('MCE_ADAPTIVE_MIN_MINUTES'), math.ceil(duration * 2 / 60))
+    new_minutes = int(round(min(max(new_minutes, lower), get_setting('MCE_ADAPTIVE_MAX_MINUTES'))))
+
+    return new_minutes, reason
+
+
+def adapt_schedule(schedule, counters, duration, started=None):
+    """Update schedule.minutes (and next_run) from the result of a run - return the decision"""
+
+    new_minutes, reason = next_minutes(schedule.minutes, counters, duration)
+
+    decision = dict(
+        schedule=schedule.name,
+        time=timezone.now().isoformat(),
+        counters={k: counters.get(k, 0) for k in ('errors', 'created', 'updated', 'deleted')},
+        duration=round(duration, 1),
+        old_minutes=schedule.minutes,
+        new_minutes=new_minutes,
+        reason=reason,
+    )
+
+    if new_minutes != schedule.minutes:
+        started = started or timezone.now()
+        schedule.minutes = new_minutes
+        schedule.next_run = max(timezone.now(), started + timedelta(minutes=new_minutes))
+        schedule.save(update_fields=['minutes', 'next_run'])
+
+    logger.info(
+        "adaptive - [%(schedule)s] - %(reason)s - minutes %(old_minutes)s -> %(new_minutes)s" % decision
+    )
+    _record(decision)
+
+    return decision
+
+
+def adapt_schedule_by_name(name, counters, duration, started=None):
+    schedule = Schedule.objects.filter(name=name).first()
+    if not schedule:
+        logger.warning(f"adaptive - schedule [{name}] not found")
+        return None
+    return adapt_schedule(schedule, counters, duration, started=started)
+
+
+def adapt_schedule_hook(task):
+    """django-q hook of the sync schedules - the group of a scheduled task is the schedule name"""
+
+    if not task.success or not isinstance(task.result, dict) or 'created' not in task.result:
+        return None
+
+    schedule = Schedule.objects.filter(name=task.group).first()
+    if not schedule and str(task.group).isdigit():
+        schedule = Schedule.objects.filter(pk=task.group).first()
+    if not schedule:
+        return None
+
+    return adapt_schedule(schedule, task.result, task.time_taken(), started=task.started)
+
+
+def _record(decision):
+    decisions = cache.get(DECISIONS_KEY) or []
+    decisions.append(decision)
+    cache.set(DECISIONS_KEY, decisions[-get_setting('MCE_ADAPTIVE_AUDIT_SIZE'):], None)
+
+
+def get_decisions(schedule_name=None):
+    """Last decisions (oldest first), for all schedules or only one"""
+
+    decisions = cache.get(DECISIONS_KEY) or []
+    if schedule_name:
+        decisions = [d for d in decisions if d['schedule'] == schedule_name]
+    return decisions
@@ -0,0 +1,169 @@
+import logging
+import time
+
+from mce_azure.core import PROVIDERS
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+RESOURCES_API_VERSION = '2019-10-01'
+
+RESOURCE_GROUPS_API_VERSION = '2019-10-01'
+
+BATCH_API_VERSION = '2020-06-01'
+
+# api-version des ressources dont le type n'a pas de version dans PROVIDERS
+DEFAULT_RESOURCE_API_VERSION = '2019-07-01'
+
+
+def resources_list_url(subscription_id):
+    return f"{get_setting('MCE_ARM_URL')}/subscriptions/{subscription_id}/resources"
+
+
+def resourcegroups_list_url(subscription_id):
+    return f"{get_setting('MCE_ARM_URL')}/subscriptions/{subscription_id}/resourcegroups"
+
+
+def iter_pages(session, url, params=None):
+    """Yield (items, nextLink) for each page of an ARM listing
+
+    The next page is requested only when the caller ask for it.
+    """
+
+    while url:
+        response = session.get(url, params=params)
+        response.raise_for_status()
+        data = response.json()
+
+        next_link = data.get('nextLink')
+        yield data.get('value', []), next_link
+
+        # nextLink contient déjà les paramètres
+        url, params = next_link, None
+
+
+def _resources_params():
+    params = {
+        'api-version': RESOURCES_API_VERSION,
+        '$expand': 'changedTime,createdTime',
+    }
+    if get_setting('MCE_ARM_PAGE_SIZE'):
+        params['$top'] = get_setting('MCE_ARM_PAGE_SIZE')
+    return params
+
+
+def resourcegroup_resources_url(subscription_id, group_name):
+    return f"{get_setting('MCE_ARM_URL')}/subscriptions/{subscription_id}/resourceGroups/{group_name}/resources"
+
+
+def iter_resourcegroup_resources_pages(subscription_id, group_name, session):
+    """Pages of the resources of one resource group"""
+
+    params = _resources_params()
+    for items, _ in iter_pages(session, resourcegroup_resources_url(subscription_id, group_name), params=params):
+        yield items
+
+
+def iter_resources_links(subscription_id, session, next_link=None):
+    """Yield (items, nextLink) of the resources listing - from next_link if given"""
+
+    if next_link:
+        yield from iter_pages(session, next_link)
+        return
+
+    params = _resources_params()
+
+    yield from iter_pages(session, resources_list_url(subscription_id), params=params)
+
+
+def iter_resources_pages(subscription_id, session):
+    for items, _ in iter_resources_links(subscription_id, session):
+        yield items
+
+
+def iter_resourcegroups_pages(subscription_id, session):
+    params = {'api-version': RESOURCE_GROUPS_API_VERSION}
+    for items, _ in iter_pages(session, resourcegroups_list_url(subscription_id), params=params):
+        yield items
+
+
+def batch_url():
+    return f"{get_setting('MCE_ARM_URL')}/batch"
+
+
+def resource_type_from_id(resource_id):
+    """Microsoft.Sql/servers/databases from .../providers/Microsoft.Sql/servers/srv/databases/db"""
+
+    parts = resource_id.strip('/').split('/')
+    lowered = [part.lower() for part in parts]
+    if 'providers' not in lowered:
+        return None
+    i = len(lowered) - 1 - lowered[::-1].index('providers')
+    namespace, rest = parts[i + 1], parts[i + 2:]
+    return "/".join([namespace] + rest[::2])
+
+
+_api_versions = None
+
+
+def resource_api_version(resource_type):
+    """api-version of a resource type from mce_azure PROVIDERS"""
+
+    global _api_versions
+    if _api_versions is None:
+        _api_versions = {}
+        for name, value in PROVIDERS.items():
+            if isinstance(value, dict):
+                value = value.get('api_version')
+            if isinstance(value, str):
+                _api_versions[name.lower()] = value
+
+    return _api_versions.get((resource_type or '').lower(), DEFAULT_RESOURCE_API_VERSION)
+
+
+def get_resources_batch(session, resource_ids):
+    """Detail of resources with one ARM $batch request
+
+    Return {resource_id: (resource, error)} - error is an Exception for the
+    entries of the batch with a status other than 200. A 202 response is
+    polled on its Location header until the batch is done, TimeoutError
+    after MCE_FETCH_BATCH_TIMEOUT seconds.
+    """
+
+    requests = [
+        dict(
+            httpMethod='GET',
+            name=str(i),
+            url=f"{resource_id}?api-version={resource_api_version(resource_type_from_id(resource_id))}",
+        )
+        for i, resource_id in enumerate(resource_ids)
+    ]
+
+    response = session.post(batch_url(), params={'api-version': BATCH_API_VERSION}, json=dict(requests=requests))
+    response.raise_for_status()
+
+    deadline = time.monotonic() + get_setting('MCE_FETCH_BATCH_TIMEOUT')
+
+    while response.status_code == 202:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            # fetch_batch repasse par les requêtes unitaires
+            raise TimeoutError(f"batch of [{len(resource_ids)}] resources not done after polling")
+        time.sleep(min(int(response.headers.get('Retry-After', 1)), remaining))
+        response = session.get(response.headers['Location'])
+        response.raise_for_status()
+
+    results = {resource_id: (None, Exception("missing in batch response")) for resource_id in resource_ids}
+
+    for entry in response.json().get('responses', []):
+        resource_id = resource_ids[int(entry['name'])]
+        if entry.get('httpStatusCode') == 200:
+            results[resource_id] = (entry.get('content'), None)
+        else:
+            error = (entry.get('content') or {}).get('error') or {}
+            results[resource_id] = (None, Exception(
+                f"batch entry status [{entry.get('httpStatusCode')}] : {error.get('code')} {error.get('message')}"
+            ))
+
+    return results
@@ -1,164 +1,257 @@
 import copy
+import hashlib
 import logging
 import json
-import jsonpatch
+from datetime import timedelta
+from functools import partial
+from uuid import uuid4
 
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 from django_q.tasks import schedule
 from django_q.models import Schedule
-from django_q.tasks import async_task, result
+from django_q.tasks import async_task, result, count_group
 
 # from django.core.signals import request_finished
 # request_finished.send(sender="greenlet")
 
-from mce_azure.utils import get_access_token
-from mce_azure import core as cli
 from mce_azure.core import PROVIDERS
 
-from mce_django_app.models.common import ResourceEventChange, Tag, ResourceType
+from mce_django_app.models.common import ResourceEventChange, ResourceType
 from mce_django_app import constants
 from mce_django_app.models import azure as models
 
+from mce_tasks_djq import adaptive, arm, sessions, throttle
+from mce_tasks_djq.bulk import BulkUpsert, content_hash
+from mce_tasks_djq.checkpoint import Checkpoint
+from mce_tasks_djq.conf import get_setting
+from mce_tasks_djq.delta import DeltaState
+from mce_tasks_djq.diff import make_patch
+from mce_tasks_djq.events import EventBuffer
+from mce_tasks_djq.metrics import SyncMetrics, check_query_budget
+from mce_tasks_djq.transactions import ChunkedAtomic
+from mce_tasks_djq.fetch import configure_session, fetch_resources
+from mce_tasks_djq.resolvers import resource_type_resolver, get_resource_group_index, get_group_id
+from mce_tasks_djq.utils import IdSet, MemoryPeak, id_key
+
 logger = logging.getLogger(__name__)
 
 
 def get_subscription_and_session(subscription_id):
     # TODO: raise if active=False
     subscription = models.Subscription.objects.get(subscription_id=subscription_id)
-    auth = subscription.get_auth()
-    token = get_access_token(**auth)
-    session = cli.get_session(token=token['access_token'])
+    session = sessions.get_session(subscription.get_auth())
+    # pool de connexions et contrôle des 429 partagés par les listes et les détails
+    configure_session(session, tenant=subscription.tenant)
     return subscription, session
 
 
-def create_event_change_create(new_resource):
-    """CREATE Event for ResourceAzure and ResourceGroupAzure"""
+def create_event_change_create(new_resource, events=None):
+    """CREATE Event for ResourceAzure and ResourceGroupAzure
+
+    events: EventBuffer - the event is written by the next flush
+    """
+
+    fields = dict(new_object=new_resource.to_dict(exclude=['created', 'updated']))
+
+    if events is not None:
+        return events.add(constants.EventChangeType.CREATE, new_resource, **fields)
 
     return ResourceEventChange.objects.create(
         action=constants.EventChangeType.CREATE,
         content_object=new_resource,
-        new_object=new_resource.to_dict(exclude=['created', 'updated']),
+        **fields
     )
 
 
-def create_event_change_update(old_obj, new_resource):
+def create_event_change_update(old_obj, new_resource, events=None):
     """UPDATE Event for ResourceAzure and ResourceGroupAzure"""
 
     new_obj = new_resource.to_dict(exclude=["created", "updated"])
 
-    patch = jsonpatch.JsonPatch.from_diff(old_obj, new_obj)
+    patch = make_patch(old_obj, new_obj)
 
-    if patch.patch:
+    if patch:
         msg = f"create event change update for {old_obj['resource_id']}"
         logger.info(msg)
 
-        return ResourceEventChange.objects.create(
-            action=constants.EventChangeType.UPDATE,
-            content_object=new_resource,
-            changes=list(patch),
+        fields = dict(
+            changes=patch,
             old_object=old_obj,
             new_object=new_obj,
             diff=None,
         )
 
+        if events is not None:
+            return events.add(constants.EventChangeType.UPDATE, new_resource, **fields)
 
-def create_event_change_delete(queryset):
+        return ResourceEventChange.objects.create(
+            action=constants.EventChangeType.UPDATE,
+            content_object=new_resource,
+            **fields
+        )
+
+
+def create_event_change_delete(queryset, events=None):
     """DELETE Event for ResourceAzure and ResourceGroupAzure"""
 
+    buffer = events if events is not None else EventBuffer()
+
     for doc in queryset:
-        ResourceEventChange.objects.create(
-            action=constants.EventChangeType.DELETE,
-            content_object=doc,
+        buffer.add(
+            constants.EventChangeType.DELETE,
+            doc,
             old_object=doc.to_dict(exclude=['created', 'updated']),
         )
 
+    if events is None:
+        buffer.flush()
+
+
+def delete_missing(model, subscription, found_ids, events=None, queryset=None):
+    """Create events delete and mark for deleted the rows of the subscription not in found_ids
+
+    queryset: scope of the reconciliation (default: all the rows of the subscription)
+
+    The stored ids are read once with values_list and compared with the
+    IdSet of the listing. The rows are removed by chunks of
+    MCE_SYNC_DELETE_CHUNK_SIZE to stay under the bind parameters limits,
+    each chunk (events and delete) in one transaction.
+    """
+
+    events = events if events is not None else EventBuffer()
+
+    if queryset is None:
+        queryset = model.objects.filter(subscription=subscription)
+
+    missing = [
+        pk for pk, resource_id in queryset.values_list('pk', 'resource_id').iterator()
+        if resource_id not in found_ids
+    ]
+
+    chunk_size = get_setting('MCE_SYNC_DELETE_CHUNK_SIZE')
+    _deleted = 0
+
+    for i in range(0, len(missing), chunk_size):
+        pks = missing[i:i + chunk_size]
+        with transaction.atomic():
+            create_event_change_delete(model.objects.filter(pk__in=pks).prefetch_related('tags'), events=events)
+            events.flush()
+            _deleted += model.objects.filter(pk__in=pks).delete()
+
+    return _deleted
+
 
 def sync_resource_group(subscription_id):
 
     subscription, session = get_subscription_and_session(subscription_id)
-    resources_groups = cli.get_resourcegroups_list(subscription_id, session=session)
-    company = subscription.company
-    #users = company.user_set.all()
+    resource_type_resolver.check()
+    memory = MemoryPeak()
+    metrics = SyncMetrics()
 
-    _created = 0
-    _updated = 0
-    _errors = 0
-    _deleted = 0
+    with metrics.capture(session):
+        counters = _sync_resource_groups(subscription, session, metrics, memory)
 
-    found_ids = []
+    counters['memory'] = memory.to_dict()
+    counters['metrics'] = metrics.to_dict()
 
-    for r in resources_groups:
+    check_query_budget('sync_resource_group', metrics)
 
-        resource_id = r['id'].lower()
-        found_ids.append(resource_id)
+    return counters
 
-        _type = ResourceType.objects.filter(
-            name__iexact=r['type'], provider=constants.Provider.AZURE
-        ).first()
 
-        if not _type:
-            _errors += 1
-            msg = f"resource type [{r['type']}] not found - bypass resource [{resource_id}]"
-            logger.error(msg)
-            continue
+def _sync_resource_groups(subscription, session, metrics, memory):
 
-        # TODO: ajouter autres champs ?
-        metas = r.get('properties', {}) or {}
+    subscription_id = subscription.subscription_id
+    company = subscription.company
 
-        tags_objects = []
+    _created = 0
+    _updated = 0
+    _errors = 0
+    _deleted = 0
 
-        # TODO: events et logs
-        tags = r.get('tags', {}) or {}
-        for k, v in tags.items():
-            tag, created = Tag.objects.update_or_create(
-                name=k, provider=constants.Provider.AZURE, defaults=dict(value=v)
-            )
-            tags_objects.append(tag)
-            # if created: todo event tag
-
-        old_resource = models.ResourceGroupAzure.objects.filter(resource_id=resource_id).first()
-        old_object = None
-        if old_resource:
-            old_object = old_resource.to_dict(exclude=["created", "updated"])
-
-        new_resource, created = models.ResourceGroupAzure.objects.update_or_create(
-            resource_id=resource_id,
-            defaults=dict(
-                name=r['name'],  # TODO: lower ?
-                subscription=subscription,
-                company=company,
-                resource_type=_type,
-                location=r['location'],
-                provider=constants.Provider.AZURE,
-                metas=metas,
-            ),
-        )
-        if tags_objects:
-            new_resource.tags.set(tags_objects)
+    found_ids = IdSet()
 
-        if created:
-            _created += 1
-            #create_event_change_create(new_resource)
-        else:
-            changes = create_event_change_update(old_object, new_resource)
-            if changes:
-                _updated += 1
+    events = EventBuffer()
+
+    upsert = BulkUpsert(
+        models.ResourceGroupAzure,
+        models.ResourceGroupAzure.objects.filter(subscription=subscription),
+        on_created=metrics.timed('diff', partial(create_event_change_create, events=events)),
+        on_updated=metrics.timed('diff', partial(create_event_change_update, events=events)),
+    )
+    with metrics.phase('load'):
+        upsert.load()
+
+    def _flush():
+        with metrics.phase('write'):
+            upsert.flush()
+        with metrics.phase('events'):
+            events.flush()
+
+    def _iter_groups():
+        for page in metrics.iterate('listing', arm.iter_resourcegroups_pages(subscription_id, session)):
+            yield from page
+            _flush()
+            memory.sample()
+
+    with ChunkedAtomic(before_commit=_flush, metrics=metrics) as chunks:
+        for r in _iter_groups():
+
+            chunks.step()
+
+            resource_id = r['id'].lower()
+            found_ids.add(resource_id)
+            metrics.incr('resources')
+
+            with metrics.phase('resolve'):
+                _type = resource_type_resolver.get(r['type'])
+
+            if not _type:
+                _errors += 1
+                msg = f"resource type [{r['type']}] not found - bypass resource [{resource_id}]"
+                logger.error(msg)
+                continue
+
+            # TODO: ajouter autres champs ?
+            metas = r.get('properties', {}) or {}
+            tags = r.get('tags', {}) or {}
+
+            with metrics.phase('hash'):
+                unchanged = upsert.is_unchanged(
+                    resource_id,
+                    content_hash(name=r['name'], location=r['location'], tags=tags, properties=metas),
+                )
+            if unchanged:
+                metrics.incr('unchanged')
+                continue
+
+            with metrics.phase('write'):
+                upsert.add(
+                    resource_id,
+                    dict(
+                        name=r['name'],  # TODO: lower ?
+                        subscription=subscription,
+                        company=company,
+                        resource_type=_type,
+                        location=r['location'],
+                        provider=constants.Provider.AZURE,
+                        metas=metas,
+                    ),
+                    tags=tags,
+                )
+
+    _created = upsert.created
+    _updated = upsert.updated
 
     logger.info(
         "sync - azure - ResourceGroupAzure - _errors[%s] - created[%s]- updated[%s]"
         % (_errors, _created, _updated)
     )
 
-    # Create events delete
-    qs = models.ResourceGroupAzure.objects.exclude(
-        resource_id__in=found_ids, subscription=subscription
-    )
-    create_event_change_delete(qs)
-
-    # Mark for deleted
-    qs = models.ResourceGroupAzure.objects.exclude(
-        resource_id__in=found_ids, subscription=subscription
-    )
-    _deleted = qs.delete()
+    with metrics.phase('delete'):
+        _deleted = delete_missing(models.ResourceGroupAzure, subscription, found_ids, events=events)
 
     logger.info(f"mark for deleted. [{_deleted}] old ResourceGroupAzure")
 
@@ -169,165 +262,645 @@ def sync_resource_group(subscription_id):
     return dict(errors=_errors, created=_created, updated=_updated, deleted=_deleted)
 
 
-def sync_resource(subscription_id):
+def _sync_resources(subscription, session, pages, delta=None, memory=None, metrics=None,
+                    found_ids=None, on_page=None):
+    """Resolve, fetch and write the resources of a listing - without the delete phase
+
+    pages: iterable of pages of listing items (dict with id and type).
+    Each page is written before the next one is requested, only the rows of
+    the current page are loaded.
+    delta: DeltaState - only the changed entries are fetched
+    memory: MemoryPeak - sampled after each page
+    metrics: SyncMetrics - time per phase
+    found_ids: IdSet completed with the ids of the listing
+    on_page: on_page(counters) called after each page is written and committed
+
+    Return (counters, found_ids)
+    """
+
+    company = subscription.company
+    metrics = metrics or SyncMetrics()
+
+    _errors = 0
+    _skipped = 0
+
+    found_ids = found_ids if found_ids is not None else IdSet()
+
+    groups = get_resource_group_index(subscription)
+    missing_groups = {}
+
+    events = EventBuffer()
+
+    upsert = BulkUpsert(
+        models.ResourceAzure,
+        models.ResourceAzure.objects.filter(subscription=subscription),
+        on_created=metrics.timed('diff', partial(create_event_change_create, events=events)),
+        on_updated=metrics.timed('diff', partial(create_event_change_update, events=events)),
+    )
+
+    def _resolve(page):
+        """Resolve type and group from the listing before fetching the detail"""
+        nonlocal _errors, _skipped
+
+        for r in page:
+
+            resource_id = r['id'].lower()
+            found_ids.add(resource_id)
+            metrics.incr('resources')
+
+            if delta and not delta.is_changed(r, known=resource_id in upsert.index):
+                _skipped += 1
+                continue
+
+            logger.debug(f"start for resource [{resource_id}]")
+
+            product_type = r['type']
+            if '|' in product_type:
+                product_type = product_type.split('|')[0]
+
+            with metrics.phase('resolve'):
+                _type = resource_type_resolver.get(product_type)
+
+            if not _type:
+                msg = f"resource type [{product_type}] not found - bypass resource [{resource_id}]"
+                logger.error(msg)
+                _errors += 1
+                continue
+
+            group_id = get_group_id(resource_id)
+            group = groups.get(group_id)
+
+            if not group:
+                missing_groups[group_id] = missing_groups.get(group_id, 0) + 1
+                _errors += 1
+                continue
+
+            yield resource_id, (_type, group, r)
+
+    def _flush():
+        with metrics.phase('write'):
+            upsert.flush()
+        with metrics.phase('events'):
+            events.flush()
+
+    with ChunkedAtomic(before_commit=_flush, metrics=metrics) as chunks:
+        for page in metrics.iterate('listing', pages):
+
+            with metrics.phase('load'):
+                upsert.load(r['id'].lower() for r in page)
+
+            fetched = metrics.iterate('fetch', fetch_resources(_resolve(page), session))
+
+            for resource_id, (_type, group, entry), resource, err in fetched:
+
+                chunks.step()
+
+                if err:
+                    msg = f"fetch resource {resource_id} error : {err}"
+                    logger.error(msg, exc_info=err)
+                    _errors += 1
+                    continue
+
+                metas = resource.get('properties', {}) or {}
+                tags = resource.get('tags', {}) or {}
+
+                metrics.incr('fetched')
+
+                with metrics.phase('hash'):
+                    digest = content_hash(
+                        name=resource['name'],
+                        location=resource.get('location'),
+                        sku=resource.get('sku'),
+                        kind=resource.get('kind'),
+                        tags=tags,
+                        properties=metas,
+                    )
+                    unchanged = upsert.is_unchanged(resource_id, digest)
+
+                if unchanged:
+                    metrics.incr('unchanged')
+                    if delta:
+                        delta.mark(entry)
+                    continue
+
+                datas = dict(
+                    name=resource['name'],
+                    subscription=subscription,
+                    company=company,
+                    resource_type=_type,
+                    location=resource.get('location'),
+                    provider=constants.Provider.AZURE,
+                    resource_group=group,
+                    metas=metas,
+                )
+
+                if resource.get('sku'):
+                    datas['sku'] = resource.get('sku')
+
+                if resource.get('kind'):
+                    datas['kind'] = resource.get('kind')
+
+                with metrics.phase('write'):
+                    upsert.add(resource_id, datas, tags=tags)
+
+                if delta:
+                    delta.mark(entry)
+
+            _flush()
+            upsert.clear()
+
+            if on_page:
+                chunks.commit()
+                on_page(dict(errors=_errors, created=upsert.created, updated=upsert.updated))
+
+            if memory:
+                memory.sample()
+
+    if missing_groups:
+        msg = "%s resource groups not found - bypass %s resources : %s" % (
+            len(missing_groups),
+            sum(missing_groups.values()),
+            ", ".join(sorted(missing_groups)),
+        )
+        logger.error(msg)
+
+    metrics.incr('errors', _errors)
+    metrics.incr('skipped', _skipped)
+
+    if _skipped:
+        logger.info(f"delta - [{_skipped}] resources unchanged since the last sync - not fetched")
+
+    return dict(errors=_errors, created=upsert.created, updated=upsert.updated), found_ids
+
+
+def _delete_resources(subscription, found_ids, resource_group=None):
+    """found_ids: IdSet of the resource ids of the listing - of resource_group only if given"""
+
+    queryset = None
+    if resource_group is not None:
+        queryset = models.ResourceAzure.objects.filter(subscription=subscription, resource_group=resource_group)
+
+    _deleted = delete_missing(models.ResourceAzure, subscription, found_ids, queryset=queryset)
+
+    logger.info("mark for deleted. [%s] old ResourceAzure" % _deleted)
+
+    return _deleted
+
+
+def sync_resource(subscription_id, incremental=None):
     """
-    TODO: faire une version qui créer une async_task pour chaque resource
     1. fetch resource by id
     2. db + event
-    > pas de gevent dans ce cas car parallélisme assurer par django-q
+
+    incremental (default: MCE_SYNC_INCREMENTAL): only the resources whose
+    listing entry changed since the last run are fetched (see DeltaState).
+    A full sync still runs every MCE_SYNC_FULL_INTERVAL seconds and the
+    delete phase always use the complete listing.
+
+    Les détails sont chargés par fetch_resources sur un pool de
+    MCE_FETCH_CONCURRENCY threads, l'écriture en base reste dans le thread
+    de la tâche.
+
+    Voir sync_resource_fanout pour une version qui répartit la souscription
+    sur plusieurs workers django-q.
+
+    With MCE_SYNC_CHECKPOINT, a Checkpoint is saved after each committed
+    page: a run stopped by the django-q timeout is resumed by the next run
+    and the delete phase only runs after a complete pass of the listing.
     """
 
     subscription, session = get_subscription_and_session(subscription_id)
-    company = subscription.company
+    resource_type_resolver.check()
+    memory = MemoryPeak()
+    metrics = SyncMetrics()
+
+    if incremental is None:
+        incremental = get_setting('MCE_SYNC_INCREMENTAL')
+
+    delta = None
+    if incremental:
+        delta = DeltaState.load(subscription.subscription_id)
+        delta.start()
+
+    checkpoint = None
+    on_page = None
+    links = {}
+
+    if get_setting('MCE_SYNC_CHECKPOINT'):
+        checkpoint = Checkpoint.load(subscription.subscription_id)
+
+        def on_page(counters):
+            checkpoint.save(links['next'], counters, links['ids'])
+
+    def _pages():
+        next_link = checkpoint.next_link if checkpoint else None
+        for items, next_link in arm.iter_resources_links(subscription.subscription_id, session, next_link=next_link):
+            links['next'] = next_link
+            links['ids'] = [r['id'] for r in items]
+            yield items
+
+    with metrics.capture(session):
+        counters, found_ids = _sync_resources(
+            subscription, session, _pages(),
+            delta=delta, memory=memory, metrics=metrics,
+            found_ids=checkpoint.found_ids if checkpoint else None,
+            on_page=on_page,
+        )
 
-    _created = 0
-    _updated = 0
-    _errors = 0
-    _deleted = 0
+        if checkpoint:
+            counters = checkpoint.total(counters)
 
-    found_ids = []
+        logger.info(
+            "sync - azure - ResourceAzure - errors[%(errors)s] - created[%(created)s]- updated[%(updated)s]"
+            % counters
+        )
 
-    for i, r in enumerate(cli.get_resources_list(subscription_id, session)):
+        with metrics.phase('delete'):
+            counters['deleted'] = _delete_resources(subscription, found_ids)
 
-        resource_id = r['id'].lower()
-        found_ids.append(resource_id)
+    if delta:
+        delta.forget(found_ids)
+        delta.save()
 
-        logger.debug(f"{i} : start for resource [{resource_id}]")
+    if checkpoint:
+        counters['resumed'] = checkpoint.resumed
+        checkpoint.clear()
 
-        product_type = r['type']
-        if '|' in product_type:
-            product_type = product_type.split('|')[0]
+    counters['throttle'] = throttle.get_throttle('subscription', subscription.subscription_id.lower()).to_dict()
 
-        _type = ResourceType.objects.filter(
-            name__iexact=product_type, provider=constants.Provider.AZURE
-        ).first()
+    counters['memory'] = memory.to_dict()
+    counters['metrics'] = metrics.to_dict()
 
-        if not _type:
-            msg = f"resource type [{product_type}] not found - bypass resource [{resource_id}]"
-            logger.error(msg)
-            _errors += 1
-            continue
+    check_query_budget('sync_resource', metrics)
 
-        group_name = resource_id.split('/')[4]
-        group_id = f"/subscriptions/{subscription.subscription_id}/resourceGroups/{group_name}"
-        # TODO: ajout company et subscription au filtre
-        group = models.ResourceGroupAzure.objects.filter(resource_id__iexact=group_id).first()
+    return counters
 
-        if not group:
-            msg = f"resource group [{group_id}] not found - bypass resource [{resource_id}]"
-            logger.error(msg)
-            _errors += 1
-            continue
 
-        try:
-            resource = cli.get_resource_by_id(resource_id, session=session)
-        except Exception as err:
-            msg = f"fetch resource {resource_id} error : {err}"
-            logger.exception(msg)
-            _errors += 1
-            continue
+def _fanout_key(group, index, kind):
+    return f"mce_tasks_djq:fanout:{group}:{index}:{kind}"
 
-        metas = resource.get('properties', {}) or {}
 
-        tags_objects = []
+def sync_resource_fanout(subscription_id, chunk_size=None):
+    """Split the listing in chunks of MCE_SYNC_FANOUT_CHUNK_SIZE resources
 
-        datas = dict(
-            name=resource['name'],
-            subscription=subscription,
-            company=company,
-            resource_type=_type,
-            location=resource.get('location'),
-            provider=constants.Provider.AZURE,
-            resource_group=group,
-            metas=metas,
-        )
+    Each chunk is an async_task (sync_resource_chunk) of the same django-q
+    group. The hook of the last finished chunk enqueue sync_resource_reduce
+    which aggregate the counters and run the delete phase.
 
-        if resource.get('sku'):
-            datas['sku'] = resource.get('sku')
+    The ids of each chunk (written here) and the counters of each chunk
+    (written by the chunk) are kept in the Django cache, not read from the
+    saved tasks: the reducer skip the delete phase if the ids of a chunk are
+    missing. The delete phase require a cache shared by the workers.
 
-        if resource.get('kind'):
-            datas['kind'] = resource.get('kind')
+    The completion of the group is read from the saved tasks: require a
+    Q_CLUSTER save_limit of 0 or above the number of chunks (-1 never save
+    the successes, a lower limit may prune the chunks).
+    """
 
-        tags = resource.get('tags', {}) or {}
-        for k, v in tags.items():
-            tag, created = Tag.objects.update_or_create(
-                name=k, provider=constants.Provider.AZURE, defaults=dict(value=v)
-            )
-            tags_objects.append(tag)
-            # if created: todo event tag
+    subscription, session = get_subscription_and_session(subscription_id)
+    chunk_size = chunk_size or get_setting('MCE_SYNC_FANOUT_CHUNK_SIZE')
+
+    entries = [
+        dict(id=r['id'], type=r['type'])
+        for page in arm.iter_resources_pages(subscription.subscription_id, session)
+        for r in page
+    ]
+    chunks = [entries[i:i + chunk_size] for i in range(0, len(entries), chunk_size)]
+
+    group = f"{subscription_id} : az-sync-resources : {uuid4().hex}"
+
+    logger.info(f"sync - azure - fanout [{len(entries)}] resources in [{len(chunks)}] tasks - group [{group}]")
 
-        old_resource = models.ResourceAzure.objects.filter(resource_id=resource_id).first()
-        old_object = None
-        if old_resource:
-            old_object = old_resource.to_dict(exclude=["created", "updated"])
+    cache.set_many({
+        _fanout_key(group, index, 'ids'): [id_key(r['id']) for r in chunk]
+        for index, chunk in enumerate(chunks)
+    }, 86400)
 
-        new_resource, created = models.ResourceAzure.objects.update_or_create(
-            resource_id=resource_id, defaults=datas
+    if not chunks:
+        async_task(
+            'mce_tasks_djq.azure.sync_resource_reduce', subscription_id, group, 0,
+            task_name=f"{subscription_id} : az-sync-resources-reduce",
         )
 
-        if tags_objects:
-            new_resource.tags.set(tags_objects)
+    for index, chunk in enumerate(chunks):
+        async_task(
+            'mce_tasks_djq.azure.sync_resource_chunk', subscription_id, chunk, group, index,
+            chunks_count=len(chunks),
+            group=group,
+            hook='mce_tasks_djq.azure.sync_resource_chunk_hook',
+        )
+
+    return dict(group=group, resources=len(entries), chunks=len(chunks))
+
+
+def sync_resource_chunk(subscription_id, entries, group, index, chunks_count=None):
+    """Sync a part of the listing - the delete phase is made by sync_resource_reduce"""
+
+    subscription, session = get_subscription_and_session(subscription_id)
+    resource_type_resolver.check()
+
+    counters, _ = _sync_resources(subscription, session, [entries])
+
+    cache.set(_fanout_key(group, index, 'counters'), counters, 86400)
+
+    return counters
+
+
+def sync_resource_chunk_hook(task):
+    """Enqueue sync_resource_reduce when all the chunks of the group are done
+
+    count_group count the finished tasks of the group, successes and failures.
+    The cache.add guard only dedupe the reducer if the cache is shared by the
+    workers (not LocMemCache).
+    """
+
+    chunks_count = task.kwargs['chunks_count']
+
+    if count_group(task.group) < chunks_count:
+        return
+
+    # un seul reducer même si deux hooks voient le groupe complet
+    if not cache.add(f"mce_tasks_djq:reduce:{task.group}", True, 86400):
+        return
+
+    async_task(
+        'mce_tasks_djq.azure.sync_resource_reduce', task.args[0], task.group, chunks_count,
+        task_name=f"{task.args[0]} : az-sync-resources-reduce",
+    )
+
+
+def sync_resource_reduce(subscription_id, group, chunks_count):
+    """Aggregate the counters of the chunks and run the delete phase
+
+    The delete phase is skipped if the ids of a chunk are missing.
+    """
+
+    subscription = models.Subscription.objects.get(subscription_id=subscription_id)
+
+    counters = dict(errors=0, created=0, updated=0)
+    found_ids = IdSet()
+    complete = True
 
-        if created:
-            _created += 1
-            #create_event_change_create(new_resource)
-        else:
-            changes = create_event_change_update(old_object, new_resource)
-            if changes:
-                _updated += 1
+    for index in range(chunks_count):
+        keys = cache.get(_fanout_key(group, index, 'ids'))
+        chunk_counters = cache.get(_fanout_key(group, index, 'counters'))
+        cache.delete_many([_fanout_key(group, index, 'ids'), _fanout_key(group, index, 'counters')])
+
+        if keys is None:
+            logger.error(f"fanout - ids of chunk [{index}] of group [{group}] not found")
+            complete = False
+            continue
+
+        found_ids.update_keys(keys)
+
+        if chunk_counters is None:
+            logger.error(f"fanout - chunk [{index}] of group [{group}] failed")
+            counters['errors'] += len(keys)
+            continue
+
+        for k in counters:
+            counters[k] += chunk_counters[k]
 
     logger.info(
-        "sync - azure - ResourceAzure - errors[%s] - created[%s]- updated[%s]"
-        % (_errors, _created, _updated)
+        "sync - azure - ResourceAzure - errors[%(errors)s] - created[%(created)s]- updated[%(updated)s]"
+        % counters
     )
 
-    # Create events delete
-    qs = models.ResourceAzure.objects.exclude(
-        resource_id__in=found_ids, subscription=subscription
+    if complete:
+        counters['deleted'] = _delete_resources(subscription, found_ids)
+    else:
+        logger.error(f"fanout - incomplete group [{group}] - bypass delete phase")
+        counters['deleted'] = 0
+
+    return counters
+
+
+def sync_resource_sharded(subscription_id):
+    """One sync_resource_shard task per resource group stored by sync_resource_group
+
+    Each task lists and reconciles the resources of its group only, a failed
+    group does not block the others. The resources of the groups no longer
+    stored are deleted here.
+    """
+
+    subscription = models.Subscription.objects.get(subscription_id=subscription_id)
+    groups = models.ResourceGroupAzure.objects.filter(subscription=subscription)
+
+    # ressources des groupes supprimés
+    orphans = delete_missing(
+        models.ResourceAzure, subscription, IdSet(),
+        queryset=models.ResourceAzure.objects.filter(
+            subscription=subscription, resource_group__isnull=False,
+        ).exclude(resource_group__in=groups),
     )
-    create_event_change_delete(qs)
 
-    qs = models.ResourceAzure.objects.exclude(
-        resource_id__in=found_ids, subscription=subscription
+    group = f"{subscription_id} : az-sync-resources-sharded : {uuid4().hex}"
+    group_ids = list(groups.values_list('resource_id', flat=True))
+
+    for group_id in group_ids:
+        async_task(
+            'mce_tasks_djq.azure.sync_resource_shard', subscription_id, group_id,
+            group=group,
+            task_name=f"{subscription_id} : az-sync-resources : {group_id.rsplit('/', 1)[-1]}",
+        )
+
+    logger.info(f"sync - azure - sharded [{len(group_ids)}] resource groups - group [{group}]")
+
+    return dict(group=group, resource_groups=len(group_ids), deleted=orphans)
+
+
+def sync_resource_shard(subscription_id, group_id):
+    """Sync the resources of one resource group - the delete phase is limited to the group"""
+
+    subscription, session = get_subscription_and_session(subscription_id)
+    resource_type_resolver.check()
+    memory = MemoryPeak()
+    metrics = SyncMetrics()
+
+    resource_group = models.ResourceGroupAzure.objects.get(subscription=subscription, resource_id__iexact=group_id)
+
+    with metrics.capture(session):
+        counters, found_ids = _sync_resources(
+            subscription, session,
+            arm.iter_resourcegroup_resources_pages(subscription.subscription_id, resource_group.name, session),
+            memory=memory, metrics=metrics,
+        )
+
+        with metrics.phase('delete'):
+            counters['deleted'] = _delete_resources(subscription, found_ids, resource_group=resource_group)
+
+    logger.info(
+        "sync - azure - ResourceAzure [%s] - errors[%s] - created[%s]- updated[%s] - deleted[%s]"
+        % (resource_group.name, counters['errors'], counters['created'], counters['updated'], counters['deleted'])
     )
-    _deleted = qs.delete()
 
-    logger.info("mark for deleted. [%s] old ResourceAzure" % _deleted)
+    counters['resource_group'] = resource_group.resource_id
+    counters['throttle'] = throttle.get_throttle('subscription', subscription.subscription_id.lower()).to_dict()
+
+    counters['memory'] = memory.to_dict()
+    counters['metrics'] = metrics.to_dict()
+
+    check_query_budget('sync_resource_shard', metrics)
+
+    return counters
 
-    return dict(errors=_errors, created=_created, updated=_updated, deleted=_deleted)
+
+def _sync_resource_func():
+    if get_setting('MCE_SYNC_SHARDED'):
+        return 'mce_tasks_djq.azure.sync_resource_sharded'
+    if get_setting('MCE_SYNC_FANOUT'):
+        return 'mce_tasks_djq.azure.sync_resource_fanout'
+    return 'mce_tasks_djq.azure.sync_resource'
+
+
+RESOURCE_TYPE_FINGERPRINT_KEY = 'mce_tasks_djq:resource_type:fingerprint'
 
 
 def sync_resource_type():
+    """Create/update the ResourceType of mce_azure.core.PROVIDERS
+
+    Return immediately if PROVIDERS has not changed since the last run
+    (fingerprint kept MCE_RESOURCE_TYPE_FINGERPRINT_TTL seconds). Otherwise
+    one read of the table, bulk_create of the missing names (then a read of
+    the names actually created) and bulk_update of the rows with another
+    provider.
+    """
 
     _created = 0
     _updated = 0
     _errors = 0
     _deleted = 0
 
-    # found_ids = []
-
-    # TODO: use batch insert !
-    
-    for k, v in PROVIDERS.items():
-        r, created = ResourceType.objects.update_or_create(
-            name=k, defaults=dict(provider=constants.Provider.AZURE)
+    fingerprint = hashlib.sha1(json.dumps(sorted(PROVIDERS)).encode()).hexdigest()
+    if cache.get(RESOURCE_TYPE_FINGERPRINT_KEY) == fingerprint:
+        logger.info("sync - azure - ResourceType - PROVIDERS unchanged")
+        return dict(errors=_errors, created=_created, updated=_updated, deleted=_deleted)
+
+    # toute la table: un IN de tout le catalogue dépasse la limite de paramètres de sqlite
+    existing = {r.name: r for r in ResourceType.objects.all() if r.name in PROVIDERS}
+
+    to_create = [
+        ResourceType(name=k, provider=constants.Provider.AZURE)
+        for k in PROVIDERS if k not in existing
+    ]
+    if to_create:
+        ResourceType.objects.bulk_create(
+            to_create, batch_size=get_setting('MCE_SYNC_BATCH_SIZE'), ignore_conflicts=True
         )
-        # found_ids.append(r.pk)
+        # ignore_conflicts ne dit pas quelles lignes ont été ignorées: noms présents après l'insertion
+        names = set(ResourceType.objects.values_list('name', flat=True))
+        _created = len({r.name for r in to_create} & names)
 
-        if created:
-            _created += 1
-        else:
-            _updated += 1
+    to_update = [r for r in existing.values() if r.provider != constants.Provider.AZURE]
+    for r in to_update:
+        r.provider = constants.Provider.AZURE
+    ResourceType.objects.bulk_update(to_update, ['provider'], batch_size=get_setting('MCE_SYNC_BATCH_SIZE'))
+    _updated = len(to_update)
 
     logger.info(
         "sync - azure - ResourceType - errors[%s] - created[%s]- updated[%s]"
         % (_errors, _created, _updated)
     )
 
+    if _created or _updated:
+        resource_type_resolver.invalidate()
+
+    cache.set(RESOURCE_TYPE_FINGERPRINT_KEY, fingerprint, get_setting('MCE_RESOURCE_TYPE_FINGERPRINT_TTL'))
+
     # TODO: delete ???
 
     return dict(errors=_errors, created=_created, updated=_updated, deleted=_deleted)
 
+
+def sync_subscription(subscription_id):
+    """Run sync_resource_group then sync_resource for one subscription
+
+    The resource stage is only enqueued by the group stage when it succeeds
+    (the resources of a new group would be bypassed with "resource group not
+    found"). Nothing is shared between the stages but the task arguments:
+    the stages usually run in different workers.
+    """
+
+    group = f"{subscription_id} : az-sync-subscription : {uuid4().hex}"
+
+    async_task(
+        'mce_tasks_djq.azure.sync_resource_group_stage', subscription_id, group,
+        group=group,
+        task_name=f"{subscription_id} : az-sync-resource-group",
+    )
+
+    return dict(group=group)
+
+
+def sync_resource_group_stage(subscription_id, group):
+    """First stage of sync_subscription - enqueue the resource stage if the groups are synced"""
+
+    counters = sync_resource_group(subscription_id)
+
+    async_task(
+        'mce_tasks_djq.azure.sync_resource_stage', subscription_id,
+        group=group,
+        task_name=f"{subscription_id} : az-sync-resources",
+    )
+
+    return counters
+
+
+def sync_resource_stage(subscription_id):
+    """Second stage of sync_subscription"""
+
+    if get_setting('MCE_SYNC_SHARDED'):
+        return sync_resource_sharded(subscription_id)
+
+    if get_setting('MCE_SYNC_FANOUT'):
+        return sync_resource_fanout(subscription_id)
+
+    started = timezone.now()
+    counters = sync_resource(subscription_id)
+
+    if get_setting('MCE_ADAPTIVE_SCHEDULE'):
+        duration = (timezone.now() - started).total_seconds()
+        adaptive.adapt_schedule_by_name(
+            f"{subscription_id} : az-sync-subscription", counters, duration, started=started
+        )
+
+    return counters
+
+
+def schedule_jitter(subscription_id, minutes):
+    """Stable offset (seconds) in [0, minutes[ for the first run of a subscription"""
+
+    if not get_setting('MCE_SCHEDULE_JITTER'):
+        return 0
+    return id_key(subscription_id) % (minutes * 60)
+
+
+def _create_schedule(func, subscription_id, task_name, minutes):
+
+    # minutes ajustées après chaque passage (voir mce_tasks_djq.adaptive)
+    hook = None
+    if get_setting('MCE_ADAPTIVE_SCHEDULE') and func != 'mce_tasks_djq.azure.sync_subscription':
+        hook = 'mce_tasks_djq.adaptive.adapt_schedule_hook'
+
+    # par nom: MCE_SYNC_FANOUT/MCE_SYNC_SHARDED changent la func du même planning
+    if Schedule.objects.filter(name=task_name).first():
+        # TODO: update schedule_type and minutes
+        Schedule.objects.filter(name=task_name).update(func=func, hook=hook)
+        return
+
+    # "('54d87296-b91a-47cd-93dd-955bd57b3e9a',)"
+    next_run = timezone.now() + timedelta(seconds=schedule_jitter(subscription_id, minutes))
+    schedule(
+        func,
+        subscription_id,
+        name=task_name,
+        hook=hook,
+        schedule_type=Schedule.MINUTES,
+        minutes=minutes,
+        next_run=next_run,
+    )
+
+
 def create_subscriptions_tasks():
 
     """
@@ -345,6 +918,10 @@ def create_subscriptions_tasks():
         schedule_type=Schedule.DAILY,
         #minutes=86400,
     )
+
+    MCE_SCHEDULE_MODE:
+    - independent: sync_resource_group and sync_resource have their own schedule
+    - chain: one sync_subscription schedule (groups then resources)
     """
 
     subscriptions = models.Subscription.objects.filter(active=True)
@@ -353,40 +930,35 @@ def create_subscriptions_tasks():
 
         subscription_id = subscription.subscription_id
 
-        task_name = f"{subscription_id} : az-sync-resource-group"
-        func = 'mce_tasks_djq.azure.sync_resource_group'
-
-        _filter = dict(name=task_name, func=func)
-        if Schedule.objects.filter(**_filter).first():
-            # TODO: update schedule_type and minutes
+        chain_names = [f"{subscription_id} : az-sync-subscription"]
+        independent_names = [
+            f"{subscription_id} : az-sync-resource-group",
+            f"{subscription_id} : az-sync-resources",
+        ]
+
+        if get_setting('MCE_SCHEDULE_MODE') == 'chain':
+            # plannings du mode independent d'un précédent passage
+            Schedule.objects.filter(name__in=independent_names).delete()
+            _create_schedule(
+                'mce_tasks_djq.azure.sync_subscription',
+                subscription_id,
+                f"{subscription_id} : az-sync-subscription",
+                get_setting('MCE_SYNC_RESOURCE_MINUTES'),
+            )
             continue
 
-        # TODO: settings
+        Schedule.objects.filter(name__in=chain_names).delete()
 
-        # "('54d87296-b91a-47cd-93dd-955bd57b3e9a',)"
-        schedule(
-            func,
+        _create_schedule(
+            'mce_tasks_djq.azure.sync_resource_group',
             subscription_id,
-            name=task_name,
-            schedule_type=Schedule.MINUTES,
-            minutes=60,
+            f"{subscription_id} : az-sync-resource-group",
+            get_setting('MCE_SYNC_RESOURCE_GROUP_MINUTES'),
         )
 
-        task_name = f"{subscription_id} : az-sync-resources"
-        func = 'mce_tasks_djq.azure.sync_resource'
-
-        _filter = dict(name=task_name, func=func)
-        if Schedule.objects.filter(**_filter).first():
-            # TODO: update schedule_type and minutes
-            continue
-
-        # TODO: settings 
-        # TODO: il faut que ce soit après les groups !!!
-        schedule(
-            func, 
+        _create_schedule(
+            _sync_resource_func(),
             subscription_id,
-            name=task_name,
-            schedule_type=Schedule.MINUTES,
-            minutes=30)
-
-
+            f"{subscription_id} : az-sync-resources",
+            get_setting('MCE_SYNC_RESOURCE_MINUTES'),
+        )
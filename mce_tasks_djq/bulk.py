@@ -0,0 +1,318 @@
+import hashlib
+import json
+import logging
+
+from django.db import models as django_models
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+
+from mce_tasks_djq import pgcopy
+from mce_tasks_djq.conf import get_setting
+from mce_tasks_djq.tags import TagIndex
+from mce_tasks_djq.utils import param_chunks
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(name=None, location=None, sku=None, kind=None, tags=None, properties=None):
+    """Stable hash of the normalized payload of a resource"""
+
+    payload = dict(
+        name=name,
+        location=location,
+        sku=sku or None,
+        kind=kind or None,
+        tags=tags or {},
+        properties=properties or {},
+    )
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def row_content_hash(obj):
+    """content_hash of a stored ResourceAzure/ResourceGroupAzure - tags must be prefetched"""
+
+    return content_hash(
+        name=obj.name,
+        location=obj.location,
+        sku=getattr(obj, 'sku', None),
+        kind=getattr(obj, 'kind', None),
+        tags={tag.name: tag.value for tag in obj.tags.all()},
+        properties=obj.metas,
+    )
+
+
+class BulkUpsert:
+    """Batched write path for ResourceAzure and ResourceGroupAzure
+
+    The existing rows are loaded by load() in an index keyed by resource_id,
+    all the rows of the queryset or only the rows of one page of the
+    listing. Each incoming resource is sorted into create/update/unchanged
+    and pending rows are written with bulk_create/bulk_update every
+    `batch_size` resources.
+
+    on_created(obj) and on_updated(old_object, obj) are called after each
+    flush, the update is counted only if on_updated return a true value.
+
+    is_unchanged() compare the content_hash of the incoming payload with the
+    hash of the stored row so that unchanged resources skip tags, write and
+    diff. The hash of a row is computed on first use from the index.
+
+    The tags ({name: value}) of a flush are interned in a TagIndex and
+    written in the through table with one read and one DELETE of the
+    removed pairs and one INSERT of the added pairs, then read back with one
+    prefetch. An unchanged set of tags cost no query. The statements are
+    only split for the bind parameters limit of the backend (param_chunks).
+
+    With MCE_SYNC_PG_COPY on PostgreSQL, the rows are written by
+    pgcopy.copy_upsert (COPY + INSERT ... ON CONFLICT DO UPDATE WHERE),
+    other backends use bulk_create/bulk_update.
+    """
+
+    def __init__(self, model, queryset, batch_size=None, on_created=None, on_updated=None, tag_index=None):
+        self.model = model
+        self.batch_size = batch_size or get_setting('MCE_SYNC_BATCH_SIZE')
+        self.on_created = on_created
+        self.on_updated = on_updated
+        self.tag_index = tag_index or TagIndex()
+        self.use_copy = bool(get_setting('MCE_SYNC_PG_COPY')) and pgcopy.is_available()
+        self.queryset = queryset.prefetch_related('tags')
+
+        self.index = {}
+        self.hashes = {}
+
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+
+        self._to_create = []
+        self._to_update = []
+        self._update_fields = set()
+        self._pending_ids = set()
+
+        tags_field = model._meta.get_field('tags')
+        self._through = tags_field.remote_field.through
+        self._source = self._through._meta.get_field(tags_field.m2m_field_name()).attname
+        self._target = self._through._meta.get_field(tags_field.m2m_reverse_field_name()).attname
+
+    @property
+    def pending(self):
+        return len(self._to_create) + len(self._to_update)
+
+    def load(self, resource_ids=None):
+        """Add the existing rows (or only the rows in resource_ids) to the index
+
+        resource_ids are only split for the bind parameters limit of the
+        backend (SQLite): the IN of the query and of the tags prefetch.
+        """
+
+        if resource_ids is None:
+            self.index.update((obj.resource_id, obj) for obj in self.queryset)
+            return
+
+        for chunk in param_chunks(resource_ids):
+            qs = self.queryset.filter(resource_id__in=chunk)
+            self.index.update((obj.resource_id, obj) for obj in qs)
+
+    def clear(self):
+        """Release the index - pending rows must be flushed"""
+        self.index = {}
+        self.hashes = {}
+
+    def is_unchanged(self, resource_id, digest):
+        """True (and counted as unchanged) if the stored row has the same content hash"""
+
+        obj = self.index.get(resource_id)
+        if obj is None or obj.pk is None:
+            return False
+
+        if resource_id not in self.hashes:
+            self.hashes[resource_id] = row_content_hash(obj)
+
+        if self.hashes[resource_id] != digest:
+            return False
+
+        self.unchanged += 1
+        return True
+
+    def add(self, resource_id, datas, tags=None):
+        """Sort one resource into create/update/unchanged - tags: {name: value}"""
+
+        tags = {str(name): str(value) for name, value in (tags or {}).items()}
+        obj = self.index.get(resource_id)
+
+        if resource_id in self._pending_ids:
+            # même ressource deux fois avant le flush (doublon du listing): la dernière version l'emporte
+            self._merge(obj, datas, tags)
+            return
+
+        if obj is None:
+            obj = self.model(resource_id=resource_id, **datas)
+            self.index[resource_id] = obj
+            self._to_create.append((obj, tags))
+            self._pending_ids.add(resource_id)
+        else:
+            changed = [name for name, value in datas.items() if self._differs(obj, name, value)]
+            tags_changed = set(tags.items()) != {(tag.name, tag.value) for tag in obj.tags.all()}
+
+            if not changed and not tags_changed:
+                self.unchanged += 1
+                return
+
+            old_object = obj.to_dict(exclude=["created", "updated"])
+            self.hashes.pop(resource_id, None)
+            for name in changed:
+                setattr(obj, name, datas[name])
+            self._update_fields.update(changed)
+            self._to_update.append((obj, tags if tags_changed else None, old_object))
+            self._pending_ids.add(resource_id)
+
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def _merge(self, obj, datas, tags):
+        """Replace the values of a pending row"""
+
+        changed = [name for name, value in datas.items() if self._differs(obj, name, value)]
+        for name in changed:
+            setattr(obj, name, datas[name])
+
+        if obj.pk is None:
+            self._to_create = [(o, tags if o is obj else t) for o, t in self._to_create]
+            return
+
+        tags_changed = set(tags.items()) != {(tag.name, tag.value) for tag in obj.tags.all()}
+        self._update_fields.update(changed)
+        self._to_update = [
+            (o, (tags if tags_changed else None) if o is obj else t, old) for o, t, old in self._to_update
+        ]
+
+    def flush(self):
+        """Write pending rows, tags and events"""
+
+        self._pending_ids = set()
+
+        self.tag_index.intern(
+            [tags for _, tags in self._to_create] +
+            [tags for _, tags, _ in self._to_update if tags is not None]
+        )
+
+        if self.use_copy:
+            self._copy_rows()
+
+        if self._to_create:
+            objs = [obj for obj, _ in self._to_create]
+            if not self.use_copy:
+                self.model.objects.bulk_create(objs, batch_size=self.batch_size)
+                self._fill_pks(objs)
+
+            self._set_tags(self._to_create, created=True)
+
+            for obj, _ in self._to_create:
+                if self.on_created:
+                    self.on_created(obj)
+
+            self.created += len(objs)
+            self._to_create = []
+
+        if self._to_update:
+            objs = [obj for obj, _, _ in self._to_update]
+            fields = set(self._update_fields)
+
+            if not self.use_copy:
+                now = timezone.now()
+                for field in self.model._meta.concrete_fields:
+                    if getattr(field, 'auto_now', False):
+                        for obj in objs:
+                            setattr(obj, field.attname, now)
+                        fields.add(field.name)
+
+                if fields:
+                    self.model.objects.bulk_update(objs, fields, batch_size=self.batch_size)
+
+            self._set_tags([(obj, tags) for obj, tags, _ in self._to_update if tags is not None])
+
+            for obj, tags, old_object in self._to_update:
+                if not self.on_updated or self.on_updated(old_object, obj):
+                    self.updated += 1
+
+            self._to_update = []
+            self._update_fields = set()
+
+    def _copy_rows(self):
+        """Write the pending rows with pgcopy - drop the updates of rows with the same content"""
+
+        objs = [obj for obj, _ in self._to_create] + [obj for obj, _, _ in self._to_update]
+        written = pgcopy.copy_upsert(self.model, objs)
+
+        for obj, _ in self._to_create:
+            obj.pk = written[obj.resource_id][0]
+
+        to_update = []
+        for item in self._to_update:
+            obj, tags, _ = item
+            if obj.resource_id in written or tags is not None:
+                to_update.append(item)
+            else:
+                self.unchanged += 1
+        self._to_update = to_update
+
+    def _set_tags(self, objs_tags, created=False):
+        """Replace the tags of each (obj, {name: value}) - obj.tags.all() is then prefetched"""
+
+        if not objs_tags:
+            return
+
+        to_add = []
+        removed = {}
+
+        for obj, tags in objs_tags:
+            new_pks = {tag.pk for tag in self.tag_index.get(tags)}
+            old_pks = set() if created else {tag.pk for tag in obj.tags.all()}
+            to_add.extend((obj.pk, pk) for pk in new_pks - old_pks)
+            if old_pks - new_pks:
+                removed[obj.pk] = old_pks - new_pks
+
+        if removed:
+            # une lecture et un DELETE par flush (découpés seulement pour la limite de paramètres du backend)
+            through_pks = [
+                pk
+                for sources in param_chunks(removed)
+                for pk, source, target in self._through.objects.filter(
+                    **{f"{self._source}__in": sources}
+                ).values_list('pk', self._source, self._target)
+                if target in removed[source]
+            ]
+            for pks in param_chunks(through_pks):
+                self._through.objects.filter(pk__in=pks).delete()
+
+        self._through.objects.bulk_create(
+            [self._through(**{self._source: source, self._target: target}) for source, target in to_add],
+            batch_size=self.batch_size,
+        )
+
+        objs = [obj for obj, _ in objs_tags]
+
+        for obj in objs:
+            getattr(obj, '_prefetched_objects_cache', {}).pop('tags', None)
+        prefetch_related_objects(objs, 'tags')
+
+    def _differs(self, obj, name, value):
+        field = obj._meta.get_field(name)
+        if field.is_relation:
+            if isinstance(value, django_models.Model):
+                value = value.pk
+            return getattr(obj, field.attname) != value
+        return getattr(obj, name) != value
+
+    def _fill_pks(self, objs):
+        """bulk_create ne renvoie pas les pk sur tous les backends (sqlite)"""
+
+        missing = {obj.resource_id: obj for obj in objs if obj.pk is None}
+        if not missing:
+            return
+
+        for chunk in param_chunks(missing):
+            qs = self.model.objects.filter(resource_id__in=chunk).values_list('resource_id', 'pk')
+            for resource_id, pk in qs:
+                missing[resource_id].pk = pk
@@ -0,0 +1,111 @@
+import logging
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+
+from mce_tasks_djq.conf import get_setting
+from mce_tasks_djq.utils import IdSet, id_key
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('errors', 'created', 'updated')
+
+
+class Checkpoint:
+    """Progress of the current pass of sync_resource on one subscription
+
+    Saved in the Django cache after each committed page of the listing:
+    - next_link: nextLink of the last written page
+    - counters: errors/created/updated of the pass
+    - started_at: time of the first page of the pass
+    - pass_id, pages: the id_key() of the resources of page n are saved
+      once, under their own key (page_key) - a save cost one page, not the
+      whole found_ids of the pass
+
+    A run interrupted by the django-q timeout is resumed by the next run
+    from next_link. A pass older than MCE_SYNC_CHECKPOINT_TTL, or with a
+    page evicted from the cache, is started again from the first page (the
+    nextLink tokens expire).
+    """
+
+    def __init__(self, subscription_id, next_link=None, found_ids=None, counters=None, started_at=None,
+                 pass_id=None, pages=0):
+        self.subscription_id = subscription_id
+        self.next_link = next_link
+        self.found_ids = found_ids if found_ids is not None else IdSet()
+        self.counters = counters or {k: 0 for k in COUNTERS}
+        self.started_at = started_at or time.time()
+        self.pass_id = pass_id or uuid4().hex
+        self.pages = pages
+        self.resumed = next_link is not None
+
+    @staticmethod
+    def cache_key(subscription_id):
+        return f"mce_tasks_djq:checkpoint:{subscription_id}"
+
+    def page_key(self, page):
+        return f"{self.cache_key(self.subscription_id)}:{self.pass_id}:{page}"
+
+    @classmethod
+    def load(cls, subscription_id):
+        datas = cache.get(cls.cache_key(subscription_id))
+        if not datas:
+            return cls(subscription_id)
+
+        checkpoint = cls(subscription_id, **datas)
+        if checkpoint.expired():
+            logger.warning(f"checkpoint - expired pass for subscription [{subscription_id}] - restart")
+            checkpoint.clear()
+            return cls(subscription_id)
+
+        page_keys = [checkpoint.page_key(page) for page in range(checkpoint.pages)]
+        pages = cache.get_many(page_keys)
+        if len(pages) != len(page_keys):
+            logger.warning(f"checkpoint - missing pages for subscription [{subscription_id}] - restart")
+            checkpoint.clear()
+            return cls(subscription_id)
+
+        for keys in pages.values():
+            checkpoint.found_ids.update_keys(keys)
+
+        logger.info(
+            f"checkpoint - resume subscription [{subscription_id}] after [{len(checkpoint.found_ids)}] resources"
+        )
+        return checkpoint
+
+    def age(self):
+        return time.time() - self.started_at
+
+    def expired(self):
+        return self.age() >= get_setting('MCE_SYNC_CHECKPOINT_TTL')
+
+    def save(self, next_link, counters, resource_ids=()):
+        """Record a committed page - counters: counters of the current run, resource_ids: ids of the page"""
+
+        if not next_link:
+            return
+
+        timeout = get_setting('MCE_SYNC_CHECKPOINT_TTL') - self.age()
+        if timeout <= 0:
+            return
+
+        cache.set(self.page_key(self.pages), [id_key(resource_id) for resource_id in resource_ids], timeout)
+        self.pages += 1
+
+        datas = dict(
+            next_link=next_link,
+            counters=self.total(counters),
+            started_at=self.started_at,
+            pass_id=self.pass_id,
+            pages=self.pages,
+        )
+        cache.set(self.cache_key(self.subscription_id), datas, timeout)
+
+    def total(self, counters):
+        """counters of the run + counters of the previous runs of the pass"""
+        return {k: self.counters.get(k, 0) + counters.get(k, 0) for k in COUNTERS}
+
+    def clear(self):
+        cache.delete_many([self.page_key(page) for page in range(self.pages)])
+        cache.delete(self.cache_key(self.subscription_id))
@@ -0,0 +1,82 @@
+from django.conf import settings
+
+DEFAULTS = {
+    # API Azure Resource Manager
+    'MCE_ARM_URL': 'https://management.azure.com',
+    # $top des listes de ressources (None: taille de page par défaut d'ARM)
+    'MCE_ARM_PAGE_SIZE': None,
+    # Renouvellement du token AAD (secondes avant expires_on)
+    'MCE_TOKEN_REFRESH_MARGIN': 300,
+    # Nombre de ressources écrites par bulk_create/bulk_update
+    'MCE_SYNC_BATCH_SIZE': 500,
+    # Nombre de ressources supprimées par requête
+    'MCE_SYNC_DELETE_CHUNK_SIZE': 500,
+    # Nombre de ressources par transaction (0: autocommit)
+    'MCE_SYNC_TRANSACTION_SIZE': 500,
+    # PostgreSQL: écriture des ressources par COPY + INSERT ... ON CONFLICT
+    'MCE_SYNC_PG_COPY': False,
+    # Durée (secondes) pendant laquelle un ResourceType inconnu n'est pas recherché
+    'MCE_RESOURCE_TYPE_MISS_TTL': 300,
+    # Durée de validité de l'empreinte de PROVIDERS pour sync_resource_type
+    'MCE_RESOURCE_TYPE_FINGERPRINT_TTL': 86400,
+    # Nombre d'appels get_resource_by_id simultanés (et taille du pool de connexions)
+    'MCE_FETCH_CONCURRENCY': 8,
+    # Nombre de ressources par requête ARM $batch (0: une requête par ressource, ex: 20)
+    'MCE_FETCH_BATCH_SIZE': 0,
+    # Durée max (secondes) d'attente d'un $batch en 202, ensuite une requête par ressource
+    'MCE_FETCH_BATCH_TIMEOUT': 60,
+    # Concurrence AIMD des appels ARM selon les 429 et x-ms-ratelimit-remaining-*
+    'MCE_THROTTLE': True,
+    # Nombre de nouvelles tentatives d'une requête 429
+    'MCE_THROTTLE_MAX_RETRIES': 5,
+    # Retry-After par défaut (secondes) d'une réponse 429 sans en-tête
+    'MCE_THROTTLE_RETRY_AFTER': 5,
+    # Facteur de réduction de la concurrence après un 429
+    'MCE_THROTTLE_BACKOFF': 0.5,
+    # Pas d'augmentation de la concurrence sous N lectures restantes
+    'MCE_THROTTLE_LOW_REMAINING': 100,
+    # sync_resource ne charge que les ressources modifiées depuis le dernier passage
+    'MCE_SYNC_INCREMENTAL': False,
+    # Intervalle (secondes) entre deux synchronisations complètes en mode incrémental
+    'MCE_SYNC_FULL_INTERVAL': 6 * 3600,
+    # sync_resource reprend au dernier nextLink enregistré après un timeout
+    'MCE_SYNC_CHECKPOINT': True,
+    # Age maximum (secondes) d'un passage repris (les nextLink expirent)
+    'MCE_SYNC_CHECKPOINT_TTL': 3600,
+    # independent: une planification pour les groupes et une pour les ressources
+    # chain: sync_subscription (groupes puis ressources)
+    'MCE_SCHEDULE_MODE': 'independent',
+    'MCE_SYNC_RESOURCE_GROUP_MINUTES': 60,
+    'MCE_SYNC_RESOURCE_MINUTES': 30,
+    # Ajuster les minutes des planifications selon les changements observés
+    'MCE_ADAPTIVE_SCHEDULE': False,
+    'MCE_ADAPTIVE_MIN_MINUTES': 15,
+    'MCE_ADAPTIVE_MAX_MINUTES': 360,
+    # Au moins N created/updated/deleted pour réduire l'intervalle
+    'MCE_ADAPTIVE_BUSY_CHANGES': 10,
+    'MCE_ADAPTIVE_INCREASE': 1.5,
+    'MCE_ADAPTIVE_DECREASE': 2,
+    # Nombre de décisions conservées pour l'audit
+    'MCE_ADAPTIVE_AUDIT_SIZE': 500,
+    # Répartir le premier passage des souscriptions sur l'intervalle
+    'MCE_SCHEDULE_JITTER': True,
+    # Planifier sync_resource_fanout à la place de sync_resource
+    'MCE_SYNC_FANOUT': False,
+    # Nombre de ressources par tâche pour sync_resource_fanout
+    'MCE_SYNC_FANOUT_CHUNK_SIZE': 1000,
+    # Planifier sync_resource_sharded (une tâche par groupe de ressources) à la place de sync_resource
+    'MCE_SYNC_SHARDED': False,
+    # Contrôle du nombre de requêtes SQL de sync_resource et sync_resource_group
+    # None: désactivé, log: logger.error, raise: QueryBudgetExceeded
+    'MCE_QUERY_BUDGET_MODE': None,
+    # Budget: MCE_QUERY_BUDGET_BASE + MCE_QUERY_BUDGET_PER_RESOURCE x nombre de ressources
+    'MCE_QUERY_BUDGET_BASE': 100,
+    'MCE_QUERY_BUDGET_PER_RESOURCE': 0.1,
+    # /metrics: seulement les tâches terminées depuis moins de N secondes
+    'MCE_METRICS_WINDOW': 24 * 3600,
+}
+
+
+def get_setting(name):
+    """Return settings.<name> or the default value of this application"""
+    return getattr(settings, name, DEFAULTS[name])
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import time
+
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+
+def entry_fingerprint(entry):
+    """Cheap fingerprint of a listing entry (id, name, location, tags, sku, changedTime...)"""
+    data = json.dumps(entry, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+def _changed_time(entry):
+    value = entry.get('changedTime') or entry.get('createdTime')
+    return parse_datetime(value) if value else None
+
+
+class DeltaState:
+    """High-water mark of the resource listing of one subscription
+
+    Stored in the Django cache:
+    - hwm: most recent changedTime/createdTime of the listing of the last run
+    - retry: ids of the changed entries not synced by the last run (errors)
+    - fingerprints: entry_fingerprint of the synced entries without
+      changedTime/createdTime only
+    - full_at: time of the last full reconciliation
+
+    An entry is changed if its changedTime moved past the high-water mark,
+    if it is in retry, or - without changedTime - if its fingerprint is
+    unknown/different. A resource not in the database is always changed.
+    The state grows with the errors and the entries without changedTime,
+    not with the size of the subscription.
+
+    start() switch to a full pass (every entry is changed) when the last
+    full reconciliation is older than MCE_SYNC_FULL_INTERVAL.
+    """
+
+    def __init__(self, subscription_id, hwm=None, retry=None, fingerprints=None, full_at=None):
+        self.subscription_id = subscription_id
+        self.hwm = hwm
+        self.retry = retry or set()
+        self.fingerprints = fingerprints or {}
+        self.full_at = full_at
+        self.full = False
+        self._new_hwm = hwm
+        self._pending = set()
+
+    @staticmethod
+    def cache_key(subscription_id):
+        return f"mce_tasks_djq:delta:{subscription_id}"
+
+    @classmethod
+    def load(cls, subscription_id):
+        datas = cache.get(cls.cache_key(subscription_id)) or {}
+        return cls(subscription_id, **datas)
+
+    def start(self):
+        self.full = self.full_due()
+        if self.full:
+            logger.info(f"delta - full reconciliation for subscription [{self.subscription_id}]")
+            self.retry = set()
+            self.fingerprints = {}
+
+    def save(self):
+        if self.full:
+            self.full_at = time.time()
+        datas = dict(hwm=self._new_hwm, retry=self._pending, fingerprints=self.fingerprints, full_at=self.full_at)
+        cache.set(self.cache_key(self.subscription_id), datas, None)
+        self.hwm = self._new_hwm
+        self.retry = set(self._pending)
+
+    def full_due(self):
+        """True if the last full reconciliation is older than MCE_SYNC_FULL_INTERVAL"""
+        if not self.full_at:
+            return True
+        return time.time() - self.full_at >= get_setting('MCE_SYNC_FULL_INTERVAL')
+
+    def is_changed(self, entry, known=True):
+        """known: False if the resource is not in the database"""
+
+        resource_id = entry['id'].lower()
+        changed_time = _changed_time(entry)
+
+        if changed_time and (not self._new_hwm or changed_time > self._new_hwm):
+            self._new_hwm = changed_time
+
+        if self.full or not known or resource_id in self.retry:
+            changed = True
+        elif changed_time:
+            changed = not self.hwm or changed_time > self.hwm
+        else:
+            changed = self.fingerprints.get(resource_id) != entry_fingerprint(entry)
+
+        if changed:
+            # synchronisé par mark(), sinon à refaire au prochain passage
+            self._pending.add(resource_id)
+        return changed
+
+    def mark(self, entry):
+        """Record a successfully synced entry"""
+        resource_id = entry['id'].lower()
+        self._pending.discard(resource_id)
+        if not _changed_time(entry):
+            self.fingerprints[resource_id] = entry_fingerprint(entry)
+
+    def forget(self, found_ids):
+        """Drop the state of the resources no longer in the listing"""
+        for resource_id in [k for k in self.fingerprints if k not in found_ids]:
+            del self.fingerprints[resource_id]
+        self._pending = {k for k in self._pending if k in found_ids}
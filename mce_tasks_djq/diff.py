@@ -0,0 +1,46 @@
+"""RFC 6902 patches between two to_dict() documents
+
+Faster than jsonpatch.JsonPatch.from_diff on large metas: each field is
+first compared with == (done in C) and only the dicts that differ are
+walked. A list that differs is replaced as a whole.
+"""
+
+
+def _pointer(path, key):
+    key = str(key).replace('~', '~0').replace('/', '~1')
+    return f"{path}/{key}"
+
+
+def _same(a, b):
+    # 1 == True et 1 == 1.0 pour python, pas pour json
+    return type(a) is type(b) and a == b
+
+
+def _diff(old, new, path, ops):
+    for key, value in old.items():
+        pointer = _pointer(path, key)
+        if key not in new:
+            ops.append(dict(op='remove', path=pointer))
+            continue
+
+        new_value = new[key]
+        if _same(value, new_value):
+            continue
+
+        if isinstance(value, dict) and isinstance(new_value, dict):
+            _diff(value, new_value, pointer, ops)
+        else:
+            ops.append(dict(op='replace', path=pointer, value=new_value))
+
+    for key, value in new.items():
+        if key not in old:
+            ops.append(dict(op='add', path=_pointer(path, key), value=value))
+
+
+def make_patch(old, new):
+    """Return the list of RFC 6902 operations to go from old to new"""
+
+    ops = []
+    if not _same(old, new):
+        _diff(old, new, '', ops)
+    return ops
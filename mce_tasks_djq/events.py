@@ -0,0 +1,59 @@
+import logging
+
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+
+from mce_django_app.models.common import ResourceEventChange
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """Collect ResourceEventChange during a sync and write them with bulk_create
+
+    The events are written every `batch_size` events and by flush() at the
+    end of the task. The content type of each model is resolved once.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or get_setting('MCE_SYNC_BATCH_SIZE')
+        self.written = 0
+        self._events = []
+        self._content_types = {}
+
+        gfk = next(
+            field for field in ResourceEventChange._meta.private_fields
+            if isinstance(field, GenericForeignKey)
+        )
+        self._ct_field = gfk.ct_field
+        self._fk_field = gfk.fk_field
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, action, content_object, **fields):
+        """Add an unsaved ResourceEventChange and return it"""
+
+        model = type(content_object)
+        if model not in self._content_types:
+            self._content_types[model] = ContentType.objects.get_for_model(model)
+
+        event = ResourceEventChange(action=action, **fields)
+        setattr(event, self._ct_field, self._content_types[model])
+        setattr(event, self._fk_field, content_object.pk)
+        self._events.append(event)
+
+        if len(self._events) >= self.batch_size:
+            self.flush()
+
+        return event
+
+    def flush(self):
+        if not self._events:
+            return
+        ResourceEventChange.objects.bulk_create(self._events, batch_size=self.batch_size)
+        self.written += len(self._events)
+        logger.debug(f"write [{len(self._events)}] events")
+        self._events = []
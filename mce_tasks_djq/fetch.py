@@ -0,0 +1,128 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+from requests.adapters import HTTPAdapter
+
+from mce_azure import core as cli
+
+from mce_tasks_djq import arm
+from mce_tasks_djq.conf import get_setting
+from mce_tasks_djq.throttle import ThrottledAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def configure_session(session, pool_size=None, tenant=None):
+    """Share one connection pool of pool_size keep-alive connections between the threads
+
+    With MCE_THROTTLE, the adapter is a ThrottledAdapter (429 and
+    x-ms-ratelimit-remaining-* headers, see mce_tasks_djq.throttle).
+    The adapter is kept if it is already large enough, so a session reused
+    across tasks keeps its open connections.
+    """
+
+    pool_size = pool_size or get_setting('MCE_FETCH_CONCURRENCY')
+    throttled = bool(get_setting('MCE_THROTTLE'))
+
+    adapter = session.get_adapter('https://')
+    if getattr(adapter, '_pool_maxsize', 0) >= pool_size \
+            and isinstance(adapter, ThrottledAdapter) == throttled \
+            and (tenant is None or getattr(adapter, 'tenant', None) == tenant):
+        return session
+
+    if throttled:
+        tenant = tenant or getattr(adapter, 'tenant', None)
+        adapter = ThrottledAdapter(tenant=tenant, pool_connections=1, pool_maxsize=pool_size)
+    else:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def fetch_batch(batch, session, fetch=None, get_batch=None):
+    """Fetch a list of (resource_id, context) with one $batch request
+
+    The failed entries (or all the entries if the batch request fail) are
+    fetched again one by one with fetch. Return a list of
+    (resource_id, context, resource, error).
+    """
+
+    fetch = fetch or cli.get_resource_by_id
+    get_batch = get_batch or arm.get_resources_batch
+
+    try:
+        responses = get_batch(session, [resource_id for resource_id, _ in batch])
+    except Exception as err:
+        logger.warning(f"batch of [{len(batch)}] resources failed : {err} - fallback to single requests")
+        responses = {}
+
+    results = []
+    for resource_id, context in batch:
+        resource, error = responses.get(resource_id, (None, True))
+        if error:
+            try:
+                resource, error = fetch(resource_id, session=session), None
+            except Exception as err:
+                resource, error = None, err
+        results.append((resource_id, context, resource, error))
+
+    return results
+
+
+def fetch_resources(items, session, fetch=None, concurrency=None, batch_size=None, get_batch=None):
+    """Fetch the detail of resources on a thread pool
+
+    items: iterable of (resource_id, context), consumed lazily
+    fetch: fetch(resource_id, session=session) - default: cli.get_resource_by_id
+    batch_size (default MCE_FETCH_BATCH_SIZE): if set, each call of the pool
+    is an ARM $batch request of batch_size resources (see fetch_batch)
+
+    Yield (resource_id, context, resource, error) as soon as each call finish.
+    error is the exception raised by fetch or None.
+    """
+
+    fetch = fetch or cli.get_resource_by_id
+    concurrency = concurrency or get_setting('MCE_FETCH_CONCURRENCY')
+    batch_size = get_setting('MCE_FETCH_BATCH_SIZE') if batch_size is None else batch_size
+    configure_session(session, concurrency)
+
+    items = iter(items)
+    pending = {}
+
+    def _next():
+        if not batch_size:
+            return next(items)
+        batch = list(islice(items, batch_size))
+        if not batch:
+            raise StopIteration
+        return batch
+
+    def _submit(executor):
+        # Pas plus de 2 x concurrency appels en attente pour garder la mémoire bornée
+        while len(pending) < concurrency * 2:
+            try:
+                item = _next()
+            except StopIteration:
+                return
+            if batch_size:
+                future = executor.submit(fetch_batch, item, session, fetch=fetch, get_batch=get_batch)
+            else:
+                future = executor.submit(fetch, item[0], session=session)
+            pending[future] = item
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='mce-fetch') as executor:
+        _submit(executor)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                if batch_size:
+                    yield from future.result()
+                    continue
+                resource_id, context = item
+                error = future.exception()
+                resource = None if error else future.result()
+                yield resource_id, context, resource, error
+            _submit(executor)
@@ -0,0 +1,199 @@
+"""Per-phase timers and counters of a sync task
+
+    metrics = SyncMetrics()
+    with metrics.capture(session):
+        with metrics.phase('delete'):
+            ...
+        for page in metrics.iterate('listing', pages):
+            ...
+    result['metrics'] = metrics.to_dict()
+
+The time of a phase is exclusive: a nested phase pause its parent.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import connection
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class SyncMetrics:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = defaultdict(float)
+        self.counts = Counter()
+        self.queries = 0
+        self.http_requests = 0
+        self.http_status = Counter()
+        self._stack = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        now = time.monotonic()
+        if self._stack:
+            parent, start = self._stack[-1]
+            self.phases[parent] += now - start
+        self._stack.append((name, now))
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            _, start = self._stack.pop()
+            self.phases[name] += now - start
+            if self._stack:
+                self._stack[-1] = (self._stack[-1][0], now)
+
+    def iterate(self, name, iterable):
+        """Yield the items of iterable, the time of each next() counts for the phase"""
+
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def timed(self, name, func):
+        """Wrap func in phase(name)"""
+
+        def _wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return _wrapper
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counts[name] += value
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def _count_response(self, response, *args, **kwargs):
+        with self._lock:
+            self.http_requests += 1
+            self.http_status[str(response.status_code)] += 1
+
+    @contextmanager
+    def capture(self, session=None):
+        """Count the DB queries of the task thread and the HTTP responses of session"""
+
+        if session is not None:
+            session.hooks['response'].append(self._count_response)
+        try:
+            with connection.execute_wrapper(self._count_query):
+                yield self
+        finally:
+            if session is not None:
+                session.hooks['response'].remove(self._count_response)
+
+    def to_dict(self):
+        duration = time.monotonic() - self.started
+        resources = self.counts.get('resources', 0)
+        return dict(
+            duration=round(duration, 3),
+            phases={name: round(value, 3) for name, value in self.phases.items()},
+            counts=dict(self.counts),
+            queries=self.queries,
+            http_requests=self.http_requests,
+            http_status=dict(self.http_status),
+            resources_per_second=round(resources / duration, 1) if duration else 0,
+            queries_per_resource=round(self.queries / resources, 2) if resources else None,
+        )
+
+
+def query_budget(resources, base=None, per_resource=None):
+    """Max DB queries of a sync of `resources` resources"""
+
+    base = get_setting('MCE_QUERY_BUDGET_BASE') if base is None else base
+    per_resource = get_setting('MCE_QUERY_BUDGET_PER_RESOURCE') if per_resource is None else per_resource
+    return base + math.ceil(per_resource * resources)
+
+
+def check_query_budget(name, metrics, mode=None):
+    """Compare the DB queries of a sync with query_budget()
+
+    mode (default MCE_QUERY_BUDGET_MODE): None - no check, 'log' - logger.error,
+    'raise' - QueryBudgetExceeded. Return False if the budget is exceeded.
+    """
+
+    mode = mode or get_setting('MCE_QUERY_BUDGET_MODE')
+    if not mode:
+        return True
+
+    resources = metrics.counts.get('resources', 0)
+    budget = query_budget(resources)
+    if metrics.queries <= budget:
+        return True
+
+    msg = f"{name} - [{metrics.queries}] queries for [{resources}] resources - budget [{budget}]"
+    if mode == 'raise':
+        raise QueryBudgetExceeded(msg)
+    logger.error(msg)
+    return False
+
+
+def _labels(labels):
+    return ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+
+def render_prometheus(results):
+    """Prometheus text format of sync results
+
+    results: iterable of (labels, result) - labels: dict, result: dict
+    returned by sync_resource/sync_resource_group
+    """
+
+    samples = defaultdict(list)
+    helps = dict(
+        mce_sync_resources='Counters of the last sync',
+        mce_sync_duration_seconds='Duration of the last sync',
+        mce_sync_phase_seconds='Time spent per phase of the last sync',
+        mce_sync_db_queries='DB queries of the last sync',
+        mce_sync_http_requests='HTTP requests of the last sync',
+        mce_sync_resources_per_second='Throughput of the last sync',
+        mce_sync_peak_rss_bytes='Peak RSS of the worker during the last sync',
+    )
+
+    for labels, result in results:
+        for counter in ('errors', 'created', 'updated', 'deleted'):
+            if counter in result:
+                samples['mce_sync_resources'].append((dict(labels, counter=counter), result[counter]))
+
+        metrics = result.get('metrics') or {}
+        if metrics:
+            samples['mce_sync_duration_seconds'].append((labels, metrics['duration']))
+            samples['mce_sync_db_queries'].append((labels, metrics['queries']))
+            samples['mce_sync_http_requests'].append((labels, metrics['http_requests']))
+            samples['mce_sync_resources_per_second'].append((labels, metrics['resources_per_second']))
+            for phase, value in metrics['phases'].items():
+                samples['mce_sync_phase_seconds'].append((dict(labels, phase=phase), value))
+
+        memory = result.get('memory') or {}
+        if memory:
+            samples['mce_sync_peak_rss_bytes'].append((labels, int(memory['peak_rss_mb'] * 1024 * 1024)))
+
+    lines = []
+    for name, values in samples.items():
+        lines.append(f"# HELP {name} {helps[name]}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in values:
+            lines.append(f"{name}{{{_labels(labels)}}} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,119 @@
+"""PostgreSQL fast path of BulkUpsert
+
+The rows of a batch are streamed with COPY into a temporary staging table,
+then written with one statement:
+
+    INSERT INTO <table> (...) SELECT ... FROM <staging>
+    ON CONFLICT (resource_id) DO UPDATE SET ...
+    WHERE <the content of the row differs>
+    RETURNING id, resource_id, xmax = 0
+
+Only the rows whose content actually changed are touched, the returned
+ids tell apart the created and the updated rows.
+"""
+
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+NULL = '\\N'
+
+
+def is_available(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def _copy_value(field, obj, connection):
+    value = getattr(obj, field.attname)
+    if value is None:
+        return NULL
+    if field.get_internal_type() == 'JSONField':
+        return json.dumps(value, cls=DjangoJSONEncoder)
+
+    value = field.get_db_prep_save(value, connection)
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, 'adapted'):
+        # psycopg2.extras.Json
+        return json.dumps(value.adapted, cls=DjangoJSONEncoder)
+    return str(value)
+
+
+def _copy(cursor, sql, data):
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(sql, data)
+    else:
+        # psycopg 3
+        with cursor.copy(sql) as copy:
+            copy.write(data.getvalue())
+
+
+def copy_upsert(model, objs, using='default'):
+    """Write objs (new or loaded instances of model) - return {resource_id: (pk, created)}
+
+    The rows with the same content as the stored row are not in the result.
+    """
+
+    if not objs:
+        return {}
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    columns = [f.column for f in fields]
+    table = qn(model._meta.db_table)
+    staging = qn(f"mce_staging_{model._meta.db_table}")
+    pk_column = qn(model._meta.pk.column)
+
+    now = timezone.now()
+    for obj in objs:
+        for field in fields:
+            if getattr(field, 'auto_now', False) or (getattr(field, 'auto_now_add', False) and obj.pk is None):
+                setattr(obj, field.attname, now)
+
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for obj in objs:
+        writer.writerow([_copy_value(field, obj, connection) for field in fields])
+    data.seek(0)
+
+    # colonnes mises à jour / comparées: ni resource_id, ni created, ni updated
+    updated = [f.column for f in fields if f.column != 'resource_id' and not getattr(f, 'auto_now_add', False)]
+    compared = [f.column for f in fields if f.column in updated and not getattr(f, 'auto_now', False)]
+
+    columns_sql = ", ".join(qn(c) for c in columns)
+    sql = f"""
+        INSERT INTO {table} ({columns_sql})
+        SELECT {columns_sql} FROM {staging}
+        ON CONFLICT ({qn('resource_id')}) DO UPDATE SET
+            {", ".join(f"{qn(c)} = EXCLUDED.{qn(c)}" for c in updated)}
+        WHERE {" OR ".join(f"{table}.{qn(c)}::text IS DISTINCT FROM EXCLUDED.{qn(c)}::text" for c in compared)}
+        RETURNING {table}.{pk_column}, {table}.{qn('resource_id')}, (xmax = 0)
+    """
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {columns_sql} FROM {table} WITH NO DATA"
+        )
+        _copy(cursor, f"COPY {staging} ({columns_sql}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')", data)
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+        # ON COMMIT DROP ne suffit pas dans une transaction englobante (ChunkedAtomic)
+        cursor.execute(f"DROP TABLE {staging}")
+
+    logger.debug(f"copy upsert [{len(objs)}] rows in {model._meta.db_table} - [{len(rows)}] written")
+
+    return {resource_id: (pk, created) for pk, resource_id, created in rows}
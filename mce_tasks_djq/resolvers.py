@@ -0,0 +1,96 @@
+import logging
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+
+from mce_django_app.models.common import ResourceType
+from mce_django_app.models import azure as models
+from mce_django_app import constants
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_TYPE_VERSION_KEY = 'mce_tasks_djq:resource_type:version'
+
+
+class ResourceTypeResolver:
+    """Process-wide cache of ResourceType by lower-cased name
+
+    All the rows of the provider are loaded on first use. Unknown names are
+    remembered for MCE_RESOURCE_TYPE_MISS_TTL seconds. The cache is shared by
+    the workers through a version key in the Django cache, bumped by
+    invalidate() when sync_resource_type change the table.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self._types = None
+        self._misses = {}
+        self._version = None
+
+    def check(self):
+        """Drop the local cache if another process has invalidated it"""
+        version = cache.get(RESOURCE_TYPE_VERSION_KEY)
+        if version != self._version:
+            self.clear()
+            self._version = version
+
+    def invalidate(self):
+        cache.set(RESOURCE_TYPE_VERSION_KEY, uuid4().hex, None)
+        self.clear()
+
+    def clear(self):
+        self._types = None
+        self._misses = {}
+
+    def load(self):
+        self._types = {
+            _type.name.lower(): _type
+            for _type in ResourceType.objects.filter(provider=self.provider)
+        }
+        self._misses = {}
+        logger.debug(f"load {len(self._types)} resource types for provider [{self.provider}]")
+
+    def get(self, name):
+        """Return the ResourceType for name (case-insensitive) or None"""
+
+        if self._types is None:
+            self.load()
+
+        key = name.lower()
+        _type = self._types.get(key)
+        if _type:
+            return _type
+
+        now = time.monotonic()
+        if self._misses.get(key, 0) > now:
+            return None
+
+        # Ajouté depuis le chargement ?
+        _type = ResourceType.objects.filter(name__iexact=name, provider=self.provider).first()
+        if _type:
+            self._types[key] = _type
+            self._misses.pop(key, None)
+            return _type
+
+        self._misses[key] = now + get_setting('MCE_RESOURCE_TYPE_MISS_TTL')
+        return None
+
+
+resource_type_resolver = ResourceTypeResolver(constants.Provider.AZURE)
+
+
+def get_resource_group_index(subscription):
+    """ResourceGroupAzure of the subscription keyed by lower-cased resource_id"""
+
+    return {
+        group.resource_id.lower(): group
+        for group in models.ResourceGroupAzure.objects.filter(subscription=subscription)
+    }
+
+
+def get_group_id(resource_id):
+    """/subscriptions/xxx/resourceGroups/MY_RG/providers/... -> /subscriptions/xxx/resourcegroups/my_rg"""
+    return "/".join(resource_id.split('/')[:5]).lower()
@@ -0,0 +1,80 @@
+import hashlib
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+from mce_azure.utils import get_access_token
+from mce_azure import core as cli
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+# sessions keep-alive du worker : auth key -> (access_token, session)
+_sessions = {}
+_lock = threading.Lock()
+
+
+def auth_key(auth):
+    """Key of the credentials of subscription.get_auth(): tenant, client_id and a hash of the secret
+
+    The other fields of get_auth() (subscription...) are ignored: the
+    subscriptions of the same service principal share the token.
+    """
+    secret = hashlib.sha256(str(auth.get('secret') or '').encode()).hexdigest()
+    return f"{auth.get('tenant')}:{auth.get('client_id')}:{secret}"
+
+
+def _expires_on(token):
+    if token.get('expires_on'):
+        return int(token['expires_on'])
+    return int(time.time()) + int(token.get('expires_in', 3599))
+
+
+def get_token(auth):
+    """AAD token shared by all the workers through the Django cache
+
+    The token is requested again MCE_TOKEN_REFRESH_MARGIN seconds before
+    expires_on. Subscriptions with the same tenant and account share it.
+    """
+
+    key = f"mce_tasks_djq:token:{auth_key(auth)}"
+    token = cache.get(key)
+    if token:
+        return token
+
+    token = get_access_token(**auth)
+
+    timeout = _expires_on(token) - time.time() - get_setting('MCE_TOKEN_REFRESH_MARGIN')
+    if timeout > 0:
+        cache.set(key, token, int(timeout))
+
+    logger.debug(f"new access token - expires in [{int(timeout)}]s")
+    return token
+
+
+def get_session(auth):
+    """Keep-alive session of this worker for the credentials - rebuilt when the token change"""
+
+    token = get_token(auth)
+    key = auth_key(auth)
+
+    with _lock:
+        access_token, session = _sessions.get(key, (None, None))
+        if access_token != token['access_token']:
+            if session:
+                session.close()
+            session = cli.get_session(token=token['access_token'])
+            _sessions[key] = (token['access_token'], session)
+
+    return session
+
+
+def clear():
+    """Close the sessions of this worker"""
+    with _lock:
+        for _, session in _sessions.values():
+            session.close()
+        _sessions.clear()
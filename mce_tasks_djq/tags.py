@@ -0,0 +1,62 @@
+import logging
+
+from mce_django_app.models.common import Tag
+from mce_django_app import constants
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+
+class TagIndex:
+    """(name, value) -> Tag of a provider, loaded once per run
+
+    intern() create the missing tags of a batch with one bulk_create, the
+    tags already known cost no query.
+    """
+
+    def __init__(self, provider=constants.Provider.AZURE):
+        self.provider = provider
+        self.created = 0
+        self._tags = None
+
+    def load(self):
+        self._tags = {(tag.name, tag.value): tag for tag in Tag.objects.filter(provider=self.provider)}
+
+    def __len__(self):
+        return len(self._tags or {})
+
+    def intern(self, tags_list):
+        """Create the missing tags of an iterable of {name: value}"""
+
+        if self._tags is None:
+            self.load()
+
+        missing = {
+            (str(name), str(value))
+            for tags in tags_list for name, value in tags.items()
+            if (str(name), str(value)) not in self._tags
+        }
+        if not missing:
+            return
+
+        Tag.objects.bulk_create(
+            [Tag(name=name, value=value, provider=self.provider) for name, value in missing],
+            batch_size=get_setting('MCE_SYNC_BATCH_SIZE'),
+            ignore_conflicts=True,
+        )
+        self.created += len(missing)
+
+        # bulk_create ne renvoie pas les pk sur tous les backends (sqlite)
+        for tag in Tag.objects.filter(provider=self.provider, name__in={name for name, _ in missing}):
+            self._tags.setdefault((tag.name, tag.value), tag)
+
+        for key in missing - set(self._tags):
+            logger.error(f"tag [{key[0]}={key[1]}] not created")
+
+    def get(self, tags):
+        """Tags objects of {name: value} - call intern() first"""
+        return [
+            self._tags[(str(name), str(value))] for name, value in tags.items()
+            if (str(name), str(value)) in self._tags
+        ]
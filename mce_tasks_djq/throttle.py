@@ -0,0 +1,154 @@
+"""Throttle-aware concurrency of the ARM calls
+
+Each subscription and each tenant has a Throttle: an AIMD limit of the
+concurrent calls between 1 and MCE_FETCH_CONCURRENCY.
+
+- 429: the limit is multiplied by MCE_THROTTLE_BACKOFF and no call starts
+  before Retry-After, then the request is sent again (MCE_THROTTLE_MAX_RETRIES)
+- success: the limit grows by 1/limit (about +1 per round of calls) while
+  x-ms-ratelimit-remaining-*-reads is above MCE_THROTTLE_LOW_REMAINING
+
+ThrottledAdapter apply the throttles of the subscription (from the url) and
+of the tenant of the session to every request, listings and details.
+"""
+
+import logging
+import re
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_RE = re.compile(r'/subscriptions/([^/?]+)', re.IGNORECASE)
+
+REMAINING_HEADERS = {
+    'subscription': 'x-ms-ratelimit-remaining-subscription-reads',
+    'tenant': 'x-ms-ratelimit-remaining-tenant-reads',
+}
+
+# throttles du worker : (kind, key) -> Throttle
+_throttles = {}
+_lock = threading.Lock()
+
+
+class Throttle:
+    """AIMD limit of the concurrent calls of one subscription or tenant"""
+
+    def __init__(self, name, max_limit=None):
+        self.name = name
+        self.max_limit = max_limit or get_setting('MCE_FETCH_CONCURRENCY')
+        self.limit = float(self.max_limit)
+        self.inflight = 0
+        self.blocked_until = 0
+        self.throttled = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                elif self.inflight >= max(1, int(self.limit)):
+                    self._cond.wait()
+                else:
+                    break
+            self.inflight += 1
+
+    def release(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    def on_throttled(self, retry_after):
+        with self._cond:
+            self.throttled += 1
+            self.limit = max(1.0, self.limit * get_setting('MCE_THROTTLE_BACKOFF'))
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            logger.warning(
+                f"throttle - [{self.name}] - 429 - retry after [{retry_after}]s - limit [{int(self.limit)}]"
+            )
+
+    def on_success(self, remaining=None):
+        if remaining is not None and remaining < get_setting('MCE_THROTTLE_LOW_REMAINING'):
+            return
+        with self._cond:
+            if self.limit < self.max_limit:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                self._cond.notify_all()
+
+    def to_dict(self):
+        return dict(limit=int(self.limit), max_limit=self.max_limit, throttled=self.throttled)
+
+
+def get_throttle(kind, key):
+    with _lock:
+        if (kind, key) not in _throttles:
+            _throttles[(kind, key)] = Throttle(f"{kind}:{key}")
+        return _throttles[(kind, key)]
+
+
+def clear():
+    with _lock:
+        _throttles.clear()
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return get_setting('MCE_THROTTLE_RETRY_AFTER')
+
+
+def _remaining(response, kind):
+    value = response.headers.get(REMAINING_HEADERS[kind])
+    return int(value) if value and value.isdigit() else None
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """HTTPAdapter with the Throttle of the subscription of the url and of the tenant"""
+
+    def __init__(self, tenant=None, **kwargs):
+        self.tenant = tenant
+        super().__init__(**kwargs)
+
+    def throttles(self, url):
+        throttles = []
+        if self.tenant:
+            throttles.append(('tenant', get_throttle('tenant', self.tenant)))
+        match = SUBSCRIPTION_RE.search(url)
+        if match:
+            throttles.append(('subscription', get_throttle('subscription', match.group(1).lower())))
+        return throttles
+
+    def send(self, request, **kwargs):
+        throttles = self.throttles(request.url)
+        retries = 0
+
+        while True:
+            for _, throttle in throttles:
+                throttle.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            finally:
+                for _, throttle in reversed(throttles):
+                    throttle.release()
+
+            if response.status_code != 429:
+                for kind, throttle in throttles:
+                    throttle.on_success(_remaining(response, kind))
+                return response
+
+            retry_after = _retry_after(response)
+            for _, throttle in throttles:
+                throttle.on_throttled(retry_after)
+
+            if retries >= get_setting('MCE_THROTTLE_MAX_RETRIES'):
+                return response
+
+            retries += 1
+            response.close()
@@ -0,0 +1,78 @@
+import logging
+
+from django.db import transaction
+
+from mce_tasks_djq.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkedAtomic:
+    """Commit the writes of a sync every `size` resources
+
+        with ChunkedAtomic(before_commit=flush, metrics=metrics) as chunks:
+            for r in resources:
+                chunks.step()
+                ...
+
+    before_commit() must write the pending rows (BulkUpsert, EventBuffer)
+    so that they are part of the chunk. An exception rolls back the current
+    chunk only, the previous chunks stay committed.
+
+    size (default MCE_SYNC_TRANSACTION_SIZE): 0 - autocommit, no transaction.
+    The time of each commit is the 'commit' phase of metrics.
+    """
+
+    def __init__(self, size=None, before_commit=None, metrics=None, using=None):
+        self.size = get_setting('MCE_SYNC_TRANSACTION_SIZE') if size is None else size
+        self.before_commit = before_commit
+        self.metrics = metrics
+        self.using = using
+        self.count = 0
+        self.commits = 0
+        self._atomic = None
+
+    def __enter__(self):
+        self._begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit(begin=False)
+            return False
+
+        if self._atomic:
+            logger.error(f"rollback of the last [{self.count}] resources")
+            atomic, self._atomic = self._atomic, None
+            return atomic.__exit__(exc_type, exc_value, traceback)
+        return False
+
+    def _begin(self):
+        self.count = 0
+        if self.size:
+            self._atomic = transaction.atomic(using=self.using)
+            self._atomic.__enter__()
+
+    def step(self, count=1):
+        """Call before writing `count` resources - commit the chunk first if it is full"""
+        if self.size and self.count + count > self.size and self.count:
+            self.commit()
+        self.count += count
+
+    def commit(self, begin=True):
+        if self.before_commit:
+            self.before_commit()
+
+        if self._atomic:
+            atomic, self._atomic = self._atomic, None
+            if self.metrics:
+                # le temps du COMMIT seul, hors écritures
+                with self.metrics.phase('commit'):
+                    atomic.__exit__(None, None, None)
+                self.metrics.incr('commits')
+            else:
+                atomic.__exit__(None, None, None)
+            self.commits += 1
+
+        if begin:
+            self._begin()
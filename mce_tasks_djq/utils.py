@@ -0,0 +1,78 @@
+import hashlib
+
+import psutil
+
+from django.db import connections
+
+
+def id_key(resource_id):
+    """64 bits integer for a (lower-cased) resource id"""
+    digest = hashlib.blake2b(resource_id.lower().encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def param_chunks(items, per_item=1, using='default'):
+    """Split items for the bind parameters limit of the backend (SQLite: 999, PostgreSQL: none)"""
+
+    items = list(items)
+    limit = connections[using].features.max_query_params
+    if not limit or len(items) * per_item <= limit:
+        if items:
+            yield items
+        return
+
+    size = max(1, limit // per_item)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class IdSet:
+    """Compact set of resource ids
+
+    Only a 64 bits hash of each id is kept, about 4 times less memory than
+    a set of the ids for ARM resource ids.
+    """
+
+    def __init__(self, resource_ids=None):
+        self._keys = set()
+        if resource_ids:
+            self.update(resource_ids)
+
+    def add(self, resource_id):
+        self._keys.add(id_key(resource_id))
+
+    def update(self, resource_ids):
+        self._keys.update(id_key(resource_id) for resource_id in resource_ids)
+
+    def keys(self):
+        return self._keys
+
+    def update_keys(self, keys):
+        """Add id_key() values - see Checkpoint"""
+        self._keys.update(keys)
+
+    def __contains__(self, resource_id):
+        return id_key(resource_id) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class MemoryPeak:
+    """Sample the RSS of the worker process (MB)"""
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.start = self.rss()
+        self.peak = self.start
+
+    def rss(self):
+        return round(self.process.memory_info().rss / 1024 / 1024, 1)
+
+    def sample(self):
+        rss = self.rss()
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def to_dict(self):
+        return dict(start_rss_mb=self.start, rss_mb=self.sample(), peak_rss_mb=self.peak)
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.http import HttpResponse
+from django.utils import timezone
+from django_q.models import Success
+
+from mce_tasks_djq.conf import get_setting
+from mce_tasks_djq.metrics import render_prometheus
+
+SYNC_FUNCS = [
+    'mce_tasks_djq.azure.sync_resource_group',
+    'mce_tasks_djq.azure.sync_resource',
+    'mce_tasks_djq.azure.sync_resource_shard',
+]
+
+
+def latest_successes():
+    """Last Success of each (func, args) stopped in the last MCE_METRICS_WINDOW seconds
+
+    Only func/args are read to find the last tasks, the results are loaded
+    for these tasks only.
+    """
+
+    since = timezone.now() - timedelta(seconds=get_setting('MCE_METRICS_WINDOW'))
+    qs = Success.objects.filter(func__in=SYNC_FUNCS, stopped__gte=since)
+
+    latest = {}
+    for pk, func, args in qs.order_by('-stopped').values_list('pk', 'func', 'args').iterator():
+        if args:
+            latest.setdefault((func, *map(str, args)), pk)
+
+    tasks = qs.in_bulk(list(latest.values()))
+    return [(key, tasks[pk]) for key, pk in latest.items() if pk in tasks]
+
+
+def metrics(request):
+    """Prometheus metrics of the last successful sync of each subscription"""
+
+    results = []
+    for key, task in latest_successes():
+        if not isinstance(task.result, dict):
+            continue
+        labels = dict(task=task.func.rsplit('.', 1)[-1], subscription=key[1])
+        if len(key) > 2:
+            # sync_resource_shard
+            labels['resource_group'] = key[2]
+        results.append((labels, task.result))
+
+    return HttpResponse(render_prometheus(results), content_type='text/plain; version=0.0.4')
@@ -7,6 +7,8 @@ from django.contrib.staticfiles.views import serve
 from django.urls import re_path
 from django.conf import settings
 
+from mce_tasks_djq import views
+
 def _serve(request, path, insecure=False, **kwargs):
     return serve(request, path, insecure=True, show_indexes=True, **kwargs)
 
@@ -14,6 +16,7 @@ urlpatterns = [
     path('', RedirectView.as_view(pattern_name='admin:index', permanent=True)),
     path('adminmce/', admin.site.urls),
     path('i18n/', include('django.conf.urls.i18n')),
+    path('metrics/', views.metrics, name='metrics'),
     re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), _serve),
 ]
 
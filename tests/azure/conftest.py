@@ -40,3 +40,27 @@ def resource_group(subscription, mce_app_resource_type_azure_group, mce_app_comp
         provider=constants.Provider.AZURE,
         location="francecentral",
     )
+
+@pytest.fixture
+def require_resource_types():
+    return ResourceType.objects.create(
+        name="Microsoft.Compute/virtualMachines",
+        provider=constants.Provider.AZURE
+    )
+
+@pytest.fixture
+def build_resources(json_file):
+    """build_resources(count, prefix) - copies of resource-vm.json with id and name suffixed by prefix + i"""
+
+    def _build(count, prefix="", tags=None):
+        resources = []
+        for i in range(count):
+            resource = json_file("resource-vm.json")
+            resource['id'] = f"{resource['id']}{prefix}{i}"
+            resource['name'] = f"{resource['name']}{prefix}{i}"
+            if tags:
+                resource['tags'] = dict(resource['tags'], **tags)
+            resources.append(resource)
+        return resources
+
+    return _build
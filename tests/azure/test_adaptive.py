@@ -0,0 +1,39 @@
+import pytest
+
+from django_q.models import Schedule
+from django_q.tasks import schedule
+
+from mce_tasks_djq import adaptive
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+COUNTERS = dict(errors=0, created=0, updated=0, deleted=0)
+
+def test_next_minutes(settings):
+
+    settings.MCE_ADAPTIVE_MIN_MINUTES = 15
+    settings.MCE_ADAPTIVE_MAX_MINUTES = 120
+    settings.MCE_ADAPTIVE_BUSY_CHANGES = 10
+
+    assert adaptive.next_minutes(30, COUNTERS, 60) == (45, 'quiet')
+    assert adaptive.next_minutes(100, COUNTERS, 60) == (120, 'quiet')
+    assert adaptive.next_minutes(30, dict(COUNTERS, updated=20), 60) == (15, 'busy')
+    assert adaptive.next_minutes(30, dict(COUNTERS, created=2), 60) == (30, 'steady')
+
+    # never shorter than twice the duration
+    assert adaptive.next_minutes(30, dict(COUNTERS, deleted=50), 1200) == (40, 'busy')
+
+def test_adapt_schedule(settings):
+
+    settings.MCE_ADAPTIVE_MIN_MINUTES = 15
+    settings.MCE_ADAPTIVE_MAX_MINUTES = 120
+
+    name = "00000000-0000-0000-0000-000000000000 : az-sync-resources"
+    schedule('mce_tasks_djq.azure.sync_resource', 'xxx', name=name, schedule_type=Schedule.MINUTES, minutes=30)
+
+    decision = adaptive.adapt_schedule_by_name(name, COUNTERS, 10)
+    assert decision['new_minutes'] == 45
+    assert Schedule.objects.get(name=name).minutes == 45
+
+    assert adaptive.get_decisions(name) == [decision]
+    assert adaptive.get_decisions("other") == []
@@ -0,0 +1,80 @@
+from unittest.mock import patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mce_django_app.models.azure import ResourceGroupAzure
+
+from mce_tasks_djq.bulk import BulkUpsert, content_hash
+
+def test_content_hash():
+
+    digest = content_hash(
+        name="MY_VM", location="westeurope",
+        tags={"a": "1", "b": "2"}, properties={"x": {"y": 1, "z": [1, 2]}}
+    )
+
+    # stable for dict ordering and empty values
+    assert digest == content_hash(
+        name="MY_VM", location="westeurope", sku={}, kind="",
+        tags={"b": "2", "a": "1"}, properties={"x": {"z": [1, 2], "y": 1}}
+    )
+
+    assert digest != content_hash(
+        name="MY_VM", location="westeurope",
+        tags={"a": "1", "b": "3"}, properties={"x": {"y": 1, "z": [1, 2]}}
+    )
+
+@patch.object(connection.features, 'max_query_params', 2)
+def test_bulk_upsert_load_chunks(resource_group):
+    """load() split the ids only for the bind parameters limit of the backend"""
+
+    resource_ids = [resource_group.resource_id]
+    for i in range(4):
+        group = ResourceGroupAzure.objects.create(
+            resource_id=f"{resource_group.resource_id}{i}",
+            name=f"{resource_group.name}{i}",
+            company=resource_group.company,
+            resource_type=resource_group.resource_type,
+            subscription=resource_group.subscription,
+            provider=resource_group.provider,
+            location=resource_group.location,
+        )
+        resource_ids.append(group.resource_id)
+
+    upsert = BulkUpsert(ResourceGroupAzure, ResourceGroupAzure.objects.all())
+    with CaptureQueriesContext(connection) as ctx:
+        upsert.load(resource_ids + ["/subscriptions/xxx/resourcegroups/unknown"])
+
+    # 3 chunks: rows + prefetch des tags
+    assert len(ctx.captured_queries) == 6
+    assert sorted(upsert.index) == sorted(resource_ids)
+
+def test_bulk_upsert_duplicates(resource_group):
+    """The same resource twice before a flush: the last one is written"""
+
+    resource_id = f"{resource_group.resource_id}2"
+    datas = dict(
+        name="MY_RG2",
+        company=resource_group.company,
+        resource_type=resource_group.resource_type,
+        subscription=resource_group.subscription,
+        provider=resource_group.provider,
+        location="francecentral",
+    )
+
+    upsert = BulkUpsert(ResourceGroupAzure, ResourceGroupAzure.objects.all())
+    upsert.load()
+    upsert.add(resource_id, datas, tags=dict(a="1"))
+    upsert.add(resource_id, dict(datas, location="westeurope"), tags=dict(a="2"))
+    upsert.add(resource_group.resource_id, dict(name=resource_group.name), tags=dict(b="1"))
+    upsert.add(resource_group.resource_id, dict(name=resource_group.name), tags=dict(b="2"))
+    upsert.flush()
+
+    assert upsert.created == 1
+    assert upsert.updated == 1
+
+    created = ResourceGroupAzure.objects.get(resource_id=resource_id)
+    assert created.location == "westeurope"
+    assert list(created.tags.values_list('name', 'value')) == [("a", "2")]
+    assert list(resource_group.tags.values_list('name', 'value')) == [("b", "2")]
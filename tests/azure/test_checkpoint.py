@@ -0,0 +1,133 @@
+import time
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from django.core.cache import cache
+from mce_django_app.models.azure import ResourceAzure
+
+from mce_tasks_djq import azure
+from mce_tasks_djq.checkpoint import Checkpoint
+
+from tests.utils import counters
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+@pytest.fixture
+def server(settings, fake_arm, build_resources):
+    server = fake_arm(resources=build_resources(5), page_size=2)
+    settings.MCE_ARM_URL = server.url
+    return server
+
+def _sync(server, subscription):
+    with patch("mce_tasks_djq.azure.get_subscription_and_session", return_value=(subscription, requests.Session())), \
+            patch("mce_azure.core.get_resource_by_id", server.get_resource_by_id):
+        return azure.sync_resource(subscription.subscription_id)
+
+def test_checkpoint_resume(server, subscription, resource_group, require_resource_types):
+    """A run stopped in the second page is resumed from the second page"""
+
+    calls = []
+    content_hash = azure.content_hash
+
+    def _content_hash(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 3:
+            raise TimeoutError("task timeout")
+        return content_hash(*args, **kwargs)
+
+    with patch("mce_tasks_djq.azure.content_hash", side_effect=_content_hash):
+        with pytest.raises(TimeoutError):
+            _sync(server, subscription)
+
+    # la première page est commitée, pas de phase delete
+    assert ResourceAzure.objects.count() == 2
+    checkpoint = Checkpoint.load(subscription.subscription_id)
+    assert checkpoint.resumed is True
+    assert checkpoint.counters == dict(errors=0, created=2, updated=0)
+    assert len(checkpoint.found_ids) == 2
+
+    requests_before = server.requests
+    result = _sync(server, subscription)
+
+    assert result['resumed'] is True
+    assert counters(result) == dict(errors=0, created=5, updated=0, deleted=0)
+    assert ResourceAzure.objects.count() == 5
+    # 2 pages (2 et 3) + 3 détails
+    assert server.requests - requests_before == 5
+
+    # passage complet: le checkpoint est supprimé
+    assert Checkpoint.load(subscription.subscription_id).resumed is False
+
+def test_checkpoint_expired(settings, server, subscription, resource_group, require_resource_types):
+    """A pass older than MCE_SYNC_CHECKPOINT_TTL restart from the first page"""
+
+    settings.MCE_SYNC_CHECKPOINT_TTL = 60
+
+    cache.set(Checkpoint.cache_key(subscription.subscription_id), dict(
+        next_link=f"{server.url}/subscriptions/{subscription.subscription_id}/resources?$skiptoken=4",
+        counters=dict(errors=0, created=4, updated=0),
+        started_at=time.time() - 120,
+        pass_id='expired',
+        pages=0,
+    ), None)
+
+    result = _sync(server, subscription)
+
+    assert result['resumed'] is False
+    assert counters(result) == dict(errors=0, created=5, updated=0, deleted=0)
+
+def _interrupt(server, subscription, after):
+    """Stop the run on the content_hash of the resource number after + 1"""
+
+    calls = []
+    content_hash = azure.content_hash
+
+    def _content_hash(*args, **kwargs):
+        calls.append(1)
+        if len(calls) > after:
+            raise TimeoutError("task timeout")
+        return content_hash(*args, **kwargs)
+
+    with patch("mce_tasks_djq.azure.content_hash", side_effect=_content_hash):
+        with pytest.raises(TimeoutError):
+            _sync(server, subscription)
+
+def test_checkpoint_pages(fake_arm, settings, build_resources, subscription, resource_group, require_resource_types):
+    """Each save write the ids of one page, not the ids of the whole pass"""
+
+    server = fake_arm(resources=build_resources(25), page_size=2)
+    settings.MCE_ARM_URL = server.url
+
+    with patch("mce_tasks_djq.checkpoint.cache.set", wraps=cache.set) as cache_set:
+        _interrupt(server, subscription, 21)
+
+    # 10 pages commitées: 10 pages de 2 ids + 10 en-têtes sans ids
+    assert cache_set.call_count == 20
+    for call in cache_set.call_args_list:
+        assert len(call[0][1]) <= 5
+
+    checkpoint = Checkpoint.load(subscription.subscription_id)
+    assert checkpoint.pages == 10
+    assert len(checkpoint.found_ids) == 20
+
+    result = _sync(server, subscription)
+
+    assert result['resumed'] is True
+    assert counters(result) == dict(errors=0, created=25, updated=0, deleted=0)
+    assert Checkpoint.load(subscription.subscription_id).resumed is False
+    assert cache.get(checkpoint.page_key(0)) is None
+
+def test_checkpoint_page_evicted(server, subscription, resource_group, require_resource_types):
+    """A pass with an evicted page restart from the first page"""
+
+    _interrupt(server, subscription, 3)
+
+    checkpoint = Checkpoint.load(subscription.subscription_id)
+    cache.delete(checkpoint.page_key(0))
+
+    result = _sync(server, subscription)
+
+    assert result['resumed'] is False
+    assert counters(result) == dict(errors=0, created=3, updated=0, deleted=0)
@@ -0,0 +1,133 @@
+from unittest.mock import patch
+
+import requests
+
+from mce_django_app.models.azure import ResourceAzure
+
+from mce_tasks_djq import azure
+from mce_tasks_djq.delta import DeltaState
+
+from tests.utils import counters
+
+SUB_ID = "00000000-0000-0000-0000-000000000000"
+
+def _entry(name, changed_time="2020-04-01T10:00:00Z"):
+    return dict(
+        id=f"/subscriptions/{SUB_ID}/resourceGroups/MY_RG/providers/Microsoft.Compute/virtualMachines/{name}",
+        name=name,
+        type="Microsoft.Compute/virtualMachines",
+        changedTime=changed_time,
+    )
+
+def test_delta_state(settings):
+
+    settings.MCE_SYNC_FULL_INTERVAL = 3600
+
+    vm1, vm2 = _entry("VM1"), _entry("VM2")
+
+    # first run is a full reconciliation
+    delta = DeltaState.load(SUB_ID)
+    delta.start()
+    assert delta.full is True
+    assert delta.is_changed(vm1) is True
+    assert delta.is_changed(vm2) is True
+    delta.mark(vm1)
+    # VM2 in error: not marked
+    delta.save()
+
+    delta = DeltaState.load(SUB_ID)
+    delta.start()
+    assert delta.full is False
+    assert delta.is_changed(vm1) is False
+    assert delta.is_changed(vm2) is True
+    assert delta.is_changed(_entry("VM1", changed_time="2020-04-02T10:00:00Z")) is True
+    # not in the database
+    assert delta.is_changed(_entry("VM3"), known=False) is True
+
+    # full reconciliation is due again
+    settings.MCE_SYNC_FULL_INTERVAL = 0
+    delta = DeltaState.load(SUB_ID)
+    delta.start()
+    assert delta.full is True
+    assert delta.is_changed(vm1) is True
+
+def test_delta_state_size(settings):
+    """Only the errors and the entries without changedTime are stored"""
+
+    settings.MCE_SYNC_FULL_INTERVAL = 3600
+
+    entries = [_entry(f"VM{i}") for i in range(100)]
+    no_time = _entry("NO_TIME", changed_time=None)
+
+    delta = DeltaState.load(SUB_ID)
+    delta.start()
+    for entry in entries + [no_time]:
+        assert delta.is_changed(entry) is True
+        if entry is not entries[0]:
+            delta.mark(entry)
+    delta.save()
+
+    delta = DeltaState.load(SUB_ID)
+    assert delta.retry == {entries[0]['id'].lower()}
+    assert list(delta.fingerprints) == [no_time['id'].lower()]
+
+    delta.start()
+    assert delta.is_changed(no_time) is False
+    assert delta.is_changed(dict(no_time, location="westeurope")) is True
+
+def test_sync_resource_incremental(settings, fake_arm, build_resources, subscription, resource_group,
+                                   require_resource_types):
+    """Only the changed and the failed entries are fetched, the delete phase use the full listing"""
+
+    settings.MCE_SYNC_INCREMENTAL = True
+    settings.MCE_SYNC_FULL_INTERVAL = 3600
+
+    resources = build_resources(4)
+    for resource in resources:
+        resource['changedTime'] = "2020-04-01T10:00:00Z"
+
+    server = fake_arm(resources=resources, page_size=100)
+    settings.MCE_ARM_URL = server.url
+
+    fetched = []
+    failing = set()
+
+    def _get_resource_by_id(resource_id, session=None):
+        fetched.append(resource_id)
+        if resource_id in failing:
+            raise requests.ConnectionError(resource_id)
+        return server.get_resource_by_id(resource_id, session=session)
+
+    def _sync():
+        fetched.clear()
+        with patch("mce_tasks_djq.azure.get_subscription_and_session",
+                   return_value=(subscription, requests.Session())), \
+                patch("mce_azure.core.get_resource_by_id", _get_resource_by_id):
+            return azure.sync_resource(subscription.subscription_id)
+
+    # full pass
+    result = _sync()
+    assert counters(result) == dict(errors=0, created=4, updated=0, deleted=0)
+    assert len(fetched) == 4
+
+    # VM1 modifiée, VM2 modifiée mais en erreur
+    resources[1]['changedTime'] = resources[2]['changedTime'] = "2020-04-02T10:00:00Z"
+    resources[1]['location'] = resources[2]['location'] = "northeurope"
+    failing.add(resources[2]['id'].lower())
+
+    result = _sync()
+    assert sorted(fetched) == sorted([resources[1]['id'].lower(), resources[2]['id'].lower()])
+    assert counters(result) == dict(errors=1, created=0, updated=1, deleted=0)
+
+    # VM2 refaite au passage suivant, rien d'autre
+    failing.clear()
+    result = _sync()
+    assert fetched == [resources[2]['id'].lower()]
+    assert counters(result) == dict(errors=0, created=0, updated=1, deleted=0)
+
+    # VM3 supprimée: les ressources non modifiées ne sont pas supprimées
+    del server.resources[resources[3]['id'].lower()]
+    result = _sync()
+    assert fetched == []
+    assert counters(result) == dict(errors=0, created=0, updated=0, deleted=1)
+    assert ResourceAzure.objects.count() == 3
@@ -0,0 +1,27 @@
+import copy
+
+import jsonpatch
+
+from mce_tasks_djq.diff import make_patch
+
+def test_make_patch(json_file):
+
+    old = dict(resource_id="/subscriptions/xxx", name="MY_VM", metas=json_file("resource-vm.json")['properties'], tags=[])
+
+    assert make_patch(old, copy.deepcopy(old)) == []
+
+    new = copy.deepcopy(old)
+    new['metas']['hardwareProfile']['vmSize'] = "Standard_D4s_v3"
+    new['metas']['a/b~c'] = True
+    del new['metas']['provisioningState']
+    new['tags'].append(dict(name="k", value="v"))
+
+    patch = make_patch(old, new)
+    assert patch == [
+        dict(op='replace', path='/metas/hardwareProfile/vmSize', value="Standard_D4s_v3"),
+        dict(op='remove', path='/metas/provisioningState'),
+        dict(op='add', path='/metas/a~1b~0c', value=True),
+        dict(op='replace', path='/tags', value=[dict(name="k", value="v")]),
+    ]
+
+    assert jsonpatch.apply_patch(old, patch) == new
@@ -0,0 +1,29 @@
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mce_django_app.models.common import ResourceEventChange
+from mce_django_app import constants
+
+from mce_tasks_djq.events import EventBuffer
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+def test_event_buffer(resource_group):
+
+    count = ResourceEventChange.objects.count()
+
+    events = EventBuffer(batch_size=3)
+    with CaptureQueriesContext(connection) as ctx:
+        for i in range(5):
+            events.add(constants.EventChangeType.UPDATE, resource_group, changes=[], diff=None)
+
+    # one bulk insert for the first 3 events (content type already cached)
+    assert ResourceEventChange.objects.count() == count + 3
+    assert len([q for q in ctx.captured_queries if 'INSERT' in q['sql']]) == 1
+
+    events.flush()
+    assert events.written == 5
+    assert ResourceEventChange.objects.filter(
+        action=constants.EventChangeType.UPDATE).count() == 5
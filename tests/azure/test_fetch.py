@@ -0,0 +1,102 @@
+import requests
+
+from mce_tasks_djq.fetch import fetch_resources
+
+def _resource(i):
+    resource_id = f"/subscriptions/00000000-0000-0000-0000-000000000000/resourceGroups/MY_RG/providers/Microsoft.Compute/virtualMachines/VM{i}"
+    return dict(id=resource_id, name=f"VM{i}", type="Microsoft.Compute/virtualMachines")
+
+def test_fetch_resources_concurrency(fake_arm):
+
+    resources = [_resource(i) for i in range(20)]
+    server = fake_arm(resources=resources, latency=0.05)
+
+    unknown_id = resources[0]['id'] + "-unknown"
+    items = [(r['id'], i) for i, r in enumerate(resources)] + [(unknown_id, None)]
+
+    results = list(fetch_resources(
+        items, requests.Session(), fetch=server.get_resource_by_id, concurrency=5
+    ))
+
+    assert len(results) == 21
+    assert server.requests == 21
+    assert 1 < server.max_inflight <= 5
+
+    errors = [resource_id for resource_id, _, _, error in results if error]
+    assert errors == [unknown_id]
+
+    for resource_id, context, resource, error in results:
+        if not error:
+            assert resource['name'] == f"VM{context}"
+
+def test_fetch_resources_batch(settings, fake_arm):
+
+    resources = [_resource(i) for i in range(45)]
+    server = fake_arm(resources=resources, batch_errors=[resources[3]['id']])
+    settings.MCE_ARM_URL = server.url
+
+    unknown_id = resources[0]['id'] + "-unknown"
+    items = [(r['id'], i) for i, r in enumerate(resources)] + [(unknown_id, None)]
+
+    results = list(fetch_resources(
+        items, requests.Session(), fetch=server.get_resource_by_id, concurrency=2, batch_size=20
+    ))
+
+    assert len(results) == 46
+    # 3 batch + la ressource en erreur dans le batch + l'id inconnu
+    assert server.batch_requests == 3
+    assert server.requests == 5
+
+    errors = [resource_id for resource_id, _, _, error in results if error]
+    assert errors == [unknown_id]
+
+    for resource_id, context, resource, error in results:
+        if not error:
+            assert resource['name'] == f"VM{context}"
+
+def test_fetch_resources_batch_accepted(settings, fake_arm):
+    """202 + Location: the result of the batch is read on the Location"""
+
+    resources = [_resource(i) for i in range(5)]
+    server = fake_arm(resources=resources, batch_accepted=True)
+    settings.MCE_ARM_URL = server.url
+
+    results = list(fetch_resources(
+        [(r['id'], i) for i, r in enumerate(resources)], requests.Session(),
+        fetch=server.get_resource_by_id, batch_size=20,
+    ))
+
+    assert sorted(resource['name'] for _, _, resource, _ in results) == [f"VM{i}" for i in range(5)]
+    assert server.requests == 2
+
+def test_fetch_resources_batch_stuck(settings, fake_arm):
+    """A batch still 202 after MCE_FETCH_BATCH_TIMEOUT: every resource is fetched alone"""
+
+    settings.MCE_FETCH_BATCH_TIMEOUT = 0.2
+
+    resources = [_resource(i) for i in range(5)]
+    server = fake_arm(resources=resources, batch_accepted=True, batch_stuck=True, latency=0.01)
+    settings.MCE_ARM_URL = server.url
+
+    results = list(fetch_resources(
+        [(r['id'], i) for i, r in enumerate(resources)], requests.Session(),
+        fetch=server.get_resource_by_id, batch_size=20,
+    ))
+
+    assert [error for _, _, _, error in results] == [None] * 5
+    assert server.batch_requests == 1
+
+def test_fetch_resources_batch_fallback(settings, fake_arm):
+    """The batch request fail: every resource is fetched alone"""
+
+    resources = [_resource(i) for i in range(5)]
+    server = fake_arm(resources=resources)
+    settings.MCE_ARM_URL = server.url + "/unavailable"
+
+    results = list(fetch_resources(
+        [(r['id'], i) for i, r in enumerate(resources)], requests.Session(),
+        fetch=server.get_resource_by_id, batch_size=20,
+    ))
+
+    assert [error for _, _, _, error in results] == [None] * 5
+    assert server.batch_requests == 0
@@ -0,0 +1,84 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+from django.utils import timezone
+from django_q.models import Task
+from mce_django_app.models.common import Tag
+
+from mce_tasks_djq.metrics import SyncMetrics, render_prometheus
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+def test_phases_exclusive():
+
+    metrics = SyncMetrics()
+
+    with metrics.phase('write'):
+        time.sleep(0.05)
+        with metrics.phase('diff'):
+            time.sleep(0.1)
+
+    phases = metrics.to_dict()['phases']
+    assert 0.1 <= phases['diff'] < 0.15
+    assert 0.05 <= phases['write'] < 0.1
+
+def test_iterate_and_capture():
+
+    metrics = SyncMetrics()
+
+    def _pages():
+        time.sleep(0.05)
+        yield [1, 2]
+
+    with metrics.capture():
+        for page in metrics.iterate('listing', _pages()):
+            metrics.incr('resources', len(page))
+            list(Tag.objects.all())
+
+    datas = metrics.to_dict()
+    assert datas['phases']['listing'] >= 0.05
+    assert datas['counts'] == {'resources': 2}
+    assert datas['queries'] == 1
+    assert datas['queries_per_resource'] == 0.5
+
+def test_render_prometheus():
+
+    metrics = SyncMetrics()
+    metrics.incr('resources', 10)
+    with metrics.phase('write'):
+        pass
+
+    result = dict(errors=0, created=10, updated=0, deleted=1, metrics=metrics.to_dict(),
+                  memory=dict(start_rss_mb=10, rss_mb=11, peak_rss_mb=12))
+    text = render_prometheus([(dict(task='sync_resource', subscription='sub1'), result)])
+
+    assert '# TYPE mce_sync_resources gauge' in text
+    assert 'mce_sync_resources{counter="created",subscription="sub1",task="sync_resource"} 10' in text
+    assert 'mce_sync_phase_seconds{phase="write",subscription="sub1",task="sync_resource"}' in text
+    assert 'mce_sync_peak_rss_bytes{subscription="sub1",task="sync_resource"} 12582912' in text
+
+def test_metrics_view(client, settings):
+    """Last successful task of each (func, args) in MCE_METRICS_WINDOW"""
+
+    settings.MCE_METRICS_WINDOW = 3600
+
+    now = timezone.now()
+
+    def _task(name, args, created, stopped):
+        return Task.objects.create(
+            id=name, name=name, func='mce_tasks_djq.azure.sync_resource', args=args,
+            result=dict(errors=0, created=created, updated=0, deleted=0),
+            started=stopped, stopped=stopped, success=True,
+        )
+
+    _task('old', ('sub1',), 1, now - timedelta(hours=2))
+    _task('previous', ('sub1',), 2, now - timedelta(minutes=30))
+    _task('last', ('sub1',), 3, now - timedelta(minutes=1))
+    _task('other', ('sub2',), 4, now - timedelta(hours=2))
+
+    text = client.get('/metrics/').content.decode()
+
+    assert 'mce_sync_resources{counter="created",subscription="sub1",task="sync_resource"} 3' in text
+    assert 'subscription="sub2"' not in text
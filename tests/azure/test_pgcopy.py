@@ -0,0 +1,81 @@
+import pytest
+
+from django.db import connection
+
+from mce_django_app.models.azure import ResourceGroupAzure
+
+from mce_tasks_djq import pgcopy
+from mce_tasks_djq.bulk import BulkUpsert
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+postgresql = pytest.mark.skipif(connection.vendor != 'postgresql', reason="PostgreSQL only")
+
+def _group(resource_group, i):
+    return ResourceGroupAzure(
+        resource_id=f"{resource_group.resource_id}{i}",
+        name=f"{resource_group.name}{i}",
+        company=resource_group.company,
+        resource_type=resource_group.resource_type,
+        subscription=resource_group.subscription,
+        provider=resource_group.provider,
+        location=resource_group.location,
+        metas=dict(i=i),
+    )
+
+def test_copy_fallback(settings, resource_group):
+    """Other backends than PostgreSQL use bulk_create/bulk_update"""
+
+    settings.MCE_SYNC_PG_COPY = True
+
+    upsert = BulkUpsert(ResourceGroupAzure, ResourceGroupAzure.objects.all())
+    assert upsert.use_copy is pgcopy.is_available()
+
+    upsert.load()
+    upsert.add(resource_group.resource_id, dict(name="NEW_NAME"), tags=dict(a="1"))
+    upsert.flush()
+
+    assert upsert.updated == 1
+    assert ResourceGroupAzure.objects.get(pk=resource_group.pk).name == "NEW_NAME"
+
+@postgresql
+def test_copy_upsert(resource_group):
+
+    objs = [_group(resource_group, i) for i in range(3)]
+    written = pgcopy.copy_upsert(ResourceGroupAzure, objs)
+
+    assert sorted(written) == sorted(obj.resource_id for obj in objs)
+    assert all(created for _, created in written.values())
+
+    # une ligne modifiée, une identique
+    objs = [_group(resource_group, i) for i in range(2)]
+    objs[0].metas = dict(i=100)
+    written = pgcopy.copy_upsert(ResourceGroupAzure, objs)
+
+    assert list(written) == [objs[0].resource_id]
+    assert written[objs[0].resource_id][1] is False
+    assert ResourceGroupAzure.objects.get(resource_id=objs[0].resource_id).metas == dict(i=100)
+
+@postgresql
+def test_bulk_upsert_copy(settings, resource_group):
+
+    settings.MCE_SYNC_PG_COPY = True
+
+    created = []
+    upsert = BulkUpsert(ResourceGroupAzure, ResourceGroupAzure.objects.all(), on_created=created.append)
+    assert upsert.use_copy is True
+
+    upsert.load()
+    group = _group(resource_group, 1)
+    upsert.add(group.resource_id, dict(
+        name=group.name, company=group.company, resource_type=group.resource_type,
+        subscription=group.subscription, provider=group.provider, location=group.location, metas=group.metas,
+    ), tags=dict(a="1"))
+    upsert.add(resource_group.resource_id, dict(name="NEW_NAME"))
+    upsert.flush()
+
+    assert upsert.created == 1
+    assert upsert.updated == 1
+    assert created[0].pk is not None
+    assert list(created[0].tags.values_list('name', flat=True)) == ["a"]
+    assert ResourceGroupAzure.objects.get(pk=resource_group.pk).name == "NEW_NAME"
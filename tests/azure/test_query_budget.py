@@ -0,0 +1,124 @@
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mce_django_app.models.azure import ResourceAzure, ResourceGroupAzure
+
+from mce_tasks_djq import azure
+from mce_tasks_djq.metrics import QueryBudgetExceeded, query_budget
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+@pytest.fixture
+def tagged_resources(build_resources):
+    """build_resources with a tag shared by all the resources and a tag by prefix"""
+
+    def _build(count, prefix):
+        return build_resources(count, prefix, tags=dict(environment="prod", costcenter=f"CC{prefix}"))
+
+    return _build
+
+@pytest.fixture
+def run_sync(settings, fake_arm, subscription):
+    """Run func on a fake ARM server - return (result, queries)"""
+
+    settings.MCE_ARM_PAGE_SIZE = None
+    settings.MCE_SYNC_BATCH_SIZE = 5000
+    settings.MCE_SYNC_TRANSACTION_SIZE = 5000
+
+    def _run(func, resources=None, groups=None):
+        server = fake_arm(resources=resources, groups=groups, page_size=5000)
+        settings.MCE_ARM_URL = server.url
+        with patch("mce_tasks_djq.azure.get_subscription_and_session", return_value=(subscription, requests.Session())), \
+                patch("mce_azure.core.get_resource_by_id", server.get_resource_by_id), \
+                CaptureQueriesContext(connection) as ctx:
+            result = func(subscription.subscription_id)
+        return result, len(ctx.captured_queries)
+
+    return _run
+
+def assert_constant_queries(queries_1000, queries_10):
+    """queries_1000 <= queries_10 - within query_budget(1000) if the backend limit the bind parameters
+
+    SQLite (max_query_params): bulk_create/bulk_update and the IN are split
+    in several statements by Django and param_chunks.
+    """
+
+    if connection.features.max_query_params:
+        assert queries_1000 <= query_budget(1000)
+    else:
+        assert queries_1000 <= queries_10
+
+def test_query_budget():
+    assert query_budget(0, base=10, per_resource=0.1) == 10
+    assert query_budget(1000, base=10, per_resource=0.1) == 110
+    assert query_budget(5, base=10, per_resource=0.1) == 11
+
+def test_sync_resource_queries_constant(run_sync, tagged_resources, resource_group, require_resource_types):
+    """The queries of sync_resource do not depend on the number of resources"""
+
+    # warm up: content types and resource types
+    run_sync(azure.sync_resource, resources=tagged_resources(1, 'w'))
+
+    result, queries_10 = run_sync(azure.sync_resource, resources=tagged_resources(10, 'a'))
+    assert result['created'] == 10
+
+    result, queries_1000 = run_sync(azure.sync_resource, resources=tagged_resources(1000, 'b'))
+    assert result['created'] == 1000
+    assert ResourceAzure.objects.filter(tags__name="environment").count() == 1000
+
+    assert_constant_queries(queries_1000, queries_10)
+    assert result['metrics']['queries'] <= query_budget(1000)
+
+def test_sync_resource_update_queries_constant(run_sync, tagged_resources, resource_group, require_resource_types):
+
+    resources = tagged_resources(10, 'a')
+    run_sync(azure.sync_resource, resources=resources)
+    for resource in resources:
+        resource['tags']['environment'] = "dev"
+    result, queries_10 = run_sync(azure.sync_resource, resources=resources)
+    assert result['updated'] == 10
+
+    resources = tagged_resources(1000, 'a')
+    run_sync(azure.sync_resource, resources=resources)
+    for resource in resources:
+        resource['tags']['environment'] = "preprod"
+    result, queries_1000 = run_sync(azure.sync_resource, resources=resources)
+    assert result['updated'] == 1000
+    assert ResourceAzure.objects.filter(tags__value="preprod").count() == 1000
+
+    assert_constant_queries(queries_1000, queries_10)
+
+def test_sync_resource_group_queries_constant(run_sync, json_file, mce_app_resource_type_azure_group):
+
+    def _groups(count, prefix):
+        group = json_file("resource_group_list.json")['value'][0]
+        return [
+            dict(group, id=f"{group['id']}{prefix}{i}", name=f"{group['name']}{prefix}{i}", tags=dict(env="prod"))
+            for i in range(count)
+        ]
+
+    run_sync(azure.sync_resource_group, groups=_groups(1, 'w'))
+    result, queries_10 = run_sync(azure.sync_resource_group, groups=_groups(10, 'a'))
+    result, queries_1000 = run_sync(azure.sync_resource_group, groups=_groups(1000, 'b'))
+
+    assert result['created'] == 1000
+    assert ResourceGroupAzure.objects.filter(tags__name="env").count() == 1000
+    assert_constant_queries(queries_1000, queries_10)
+
+def test_query_budget_runtime_mode(settings, run_sync, tagged_resources, resource_group, require_resource_types):
+
+    settings.MCE_QUERY_BUDGET_MODE = 'raise'
+    settings.MCE_QUERY_BUDGET_BASE = 1
+    settings.MCE_QUERY_BUDGET_PER_RESOURCE = 0
+
+    with pytest.raises(QueryBudgetExceeded):
+        run_sync(azure.sync_resource, resources=tagged_resources(5, 'a'))
+
+    settings.MCE_QUERY_BUDGET_MODE = 'log'
+    result, _ = run_sync(azure.sync_resource, resources=tagged_resources(5, 'b'))
+    assert result['created'] == 5
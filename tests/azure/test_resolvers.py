@@ -0,0 +1,41 @@
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mce_django_app.models.common import ResourceType
+from mce_django_app import constants
+
+from mce_tasks_djq.resolvers import ResourceTypeResolver
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+def test_resource_type_resolver():
+
+    _type = ResourceType.objects.create(
+        name="Microsoft.Compute/virtualMachines",
+        provider=constants.Provider.AZURE
+    )
+
+    resolver = ResourceTypeResolver(constants.Provider.AZURE)
+    resolver.check()
+
+    assert resolver.get("microsoft.compute/VIRTUALMACHINES") == _type
+
+    # negative cache
+    assert resolver.get("Microsoft.Unknown/type") is None
+    with CaptureQueriesContext(connection) as ctx:
+        assert resolver.get("microsoft.compute/virtualmachines") == _type
+        assert resolver.get("Microsoft.Unknown/type") is None
+    assert len(ctx.captured_queries) == 0
+
+    # invalidate by another process
+    other = ResourceTypeResolver(constants.Provider.AZURE)
+    new_type = ResourceType.objects.create(
+        name="Microsoft.Unknown/type",
+        provider=constants.Provider.AZURE
+    )
+    other.invalidate()
+
+    resolver.check()
+    assert resolver.get("Microsoft.Unknown/type") == new_type
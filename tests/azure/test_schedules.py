@@ -0,0 +1,88 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+
+from django.utils import timezone
+from django_q.models import Schedule, Task
+
+from mce_tasks_djq.azure import create_subscriptions_tasks, sync_subscription
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+def test_create_subscriptions_tasks_chain(settings, subscription):
+
+    settings.MCE_SCHEDULE_MODE = 'chain'
+    settings.MCE_SYNC_RESOURCE_MINUTES = 30
+
+    create_subscriptions_tasks()
+    create_subscriptions_tasks()
+
+    schedule = Schedule.objects.get()
+    assert schedule.func == 'mce_tasks_djq.azure.sync_subscription'
+    assert schedule.minutes == 30
+    assert timezone.now() <= schedule.next_run < timezone.now() + timedelta(minutes=30)
+
+def test_create_subscriptions_tasks_independent(subscription):
+
+    create_subscriptions_tasks()
+
+    assert sorted(Schedule.objects.values_list('func', flat=True)) == [
+        'mce_tasks_djq.azure.sync_resource',
+        'mce_tasks_djq.azure.sync_resource_group',
+    ]
+
+def test_create_subscriptions_tasks_switch_mode(settings, subscription):
+    """The schedules of the other mode are deleted"""
+
+    create_subscriptions_tasks()
+    assert Schedule.objects.count() == 2
+
+    settings.MCE_SCHEDULE_MODE = 'chain'
+    create_subscriptions_tasks()
+    assert list(Schedule.objects.values_list('func', flat=True)) == ['mce_tasks_djq.azure.sync_subscription']
+
+    settings.MCE_SCHEDULE_MODE = 'independent'
+    create_subscriptions_tasks()
+    assert sorted(Schedule.objects.values_list('func', flat=True)) == [
+        'mce_tasks_djq.azure.sync_resource',
+        'mce_tasks_djq.azure.sync_resource_group',
+    ]
+
+def test_create_subscriptions_tasks_sharded(settings, subscription):
+    """MCE_SYNC_SHARDED replace the func of the existing sync_resource schedule"""
+
+    create_subscriptions_tasks()
+
+    settings.MCE_SYNC_SHARDED = True
+    create_subscriptions_tasks()
+
+    schedule = Schedule.objects.get(name=f"{subscription.subscription_id} : az-sync-resources")
+    assert schedule.func == 'mce_tasks_djq.azure.sync_resource_sharded'
+    assert Schedule.objects.count() == 2
+
+@patch("mce_tasks_djq.azure.sync_resource")
+@patch("mce_tasks_djq.azure.sync_resource_group")
+def test_sync_subscription_chain(sync_resource_group, sync_resource, subscription):
+
+    sync_resource_group.return_value = dict(errors=0, created=0, updated=0, deleted=0)
+    sync_resource.return_value = dict(errors=0, created=1, updated=0, deleted=0)
+
+    sync_subscription(subscription.subscription_id)
+
+    sync_resource_group.assert_called_once_with(subscription.subscription_id)
+    sync_resource.assert_called_once_with(subscription.subscription_id)
+
+@patch("mce_tasks_djq.azure.sync_resource")
+@patch("mce_tasks_djq.azure.sync_resource_group")
+def test_sync_subscription_chain_group_failed(sync_resource_group, sync_resource, subscription):
+    """The resource stage is skipped when the group stage fail"""
+
+    sync_resource_group.side_effect = Exception("ARM error")
+
+    sync_subscription(subscription.subscription_id)
+
+    sync_resource.assert_not_called()
+
+    assert Task.objects.get(func='mce_tasks_djq.azure.sync_resource_group_stage').success is False
+    assert not Task.objects.filter(func='mce_tasks_djq.azure.sync_resource_stage').exists()
@@ -0,0 +1,64 @@
+import time
+from unittest.mock import patch, MagicMock
+
+from mce_django_app.models import azure as models
+
+from mce_tasks_djq import sessions
+
+AUTH = dict(tenant="00000000-0000-0000-0000-000000000000", client_id="client", secret="secret")
+
+@patch("mce_azure.core.get_session")
+@patch("mce_tasks_djq.sessions.get_access_token")
+def test_token_and_session_cache(get_access_token, get_session):
+
+    get_access_token.return_value = dict(access_token="token1", expires_on=str(int(time.time()) + 3600))
+    get_session.side_effect = lambda token: MagicMock(token=token)
+
+    session = sessions.get_session(AUTH)
+    assert session.token == "token1"
+
+    # same tenant and account: same token and session
+    assert sessions.get_session(dict(AUTH)) is session
+    assert get_access_token.call_count == 1
+    assert get_session.call_count == 1
+
+    # other account
+    sessions.get_session(dict(AUTH, client_id="other"))
+    assert get_access_token.call_count == 2
+
+@patch("mce_azure.core.get_session")
+@patch("mce_tasks_djq.sessions.get_access_token")
+def test_token_refresh(get_access_token, get_session, settings):
+
+    settings.MCE_TOKEN_REFRESH_MARGIN = 300
+
+    # expire dans moins de MCE_TOKEN_REFRESH_MARGIN: pas mis en cache
+    get_access_token.return_value = dict(access_token="token1", expires_on=str(int(time.time()) + 120))
+    sessions.get_session(AUTH)
+
+    get_access_token.return_value = dict(access_token="token2", expires_on=str(int(time.time()) + 3600))
+    sessions.get_session(AUTH)
+
+    assert get_access_token.call_count == 2
+    get_session.assert_called_with(token="token2")
+
+@patch("mce_azure.core.get_session")
+@patch("mce_tasks_djq.sessions.get_access_token")
+def test_token_shared_by_subscriptions(get_access_token, get_session, subscription):
+    """Two subscriptions of the same account share the token and the session"""
+
+    get_access_token.return_value = dict(access_token="token1", expires_on=str(int(time.time()) + 3600))
+    get_session.side_effect = lambda token: MagicMock(token=token)
+
+    other = models.Subscription.objects.create(
+        subscription_id="11111111-1111-1111-1111-111111111111",
+        name="sub2",
+        company=subscription.company,
+        tenant=subscription.tenant,
+        location="francecentral",
+        account=subscription.account,
+    )
+
+    session = sessions.get_session(subscription.get_auth())
+    assert sessions.get_session(other.get_auth()) is session
+    assert get_access_token.call_count == 1
@@ -1,35 +1,32 @@
 from unittest.mock import patch
 
-import pytest
 import requests
 
+from django.core.cache import cache
 from django_q.tasks import fetch, async_task, result
+from django_q.models import Task
 
-from mce_django_app.models.common import ResourceEventChange, ResourceType
+from mce_django_app.models.common import ResourceEventChange
 from mce_django_app.models.azure import ResourceAzure, ResourceGroupAzure
 from mce_django_app import constants
 
-@pytest.fixture
-def require_resource_types():
-    return [
-        ResourceType.objects.create(
-            name="Microsoft.Compute/virtualMachines",
-            provider=constants.Provider.AZURE
-        )
-    ]
+from mce_tasks_djq import azure
+from mce_tasks_djq.utils import id_key
+
+from tests.utils import counters
 
 # TODO: gérer erreur retry et autre pendant le chargement d'une ressource    
 # TODO: gérer product type avec | comme "Type": "Microsoft.Sql/servers/databases|v12.0,user",
 # le v12.0,user: devient le kind
 # TODO: name avec / comme "name": "samplesqlserver01/sample-azure-mssql"
 
-@patch("mce_azure.core.get_resources_list")
+@patch("requests.Session.get")
 @patch("mce_azure.core.get_resource_by_id")
 @patch("mce_tasks_djq.azure.get_subscription_and_session")
 def test_azure_sync_resource_create(
     get_subscription_and_session,
     get_resource_by_id,
-    get_resources_list,
+    session_get,
     mock_response_class, 
     json_file, 
     subscription,
@@ -51,7 +48,7 @@ def test_azure_sync_resource_create(
     
     count = len(data_resource_list['value'])
     get_subscription_and_session.return_value = (subscription, requests.Session())
-    get_resources_list.return_value = data_resource_list['value']
+    session_get.return_value = mock_response_class(200, data_resource_list)
     get_resource_by_id.return_value = data_resource
 
     task_id = async_task(
@@ -62,7 +59,7 @@ def test_azure_sync_resource_create(
 
     task = fetch(task_id)
     assert task.success is True, result(task_id)
-    assert result(task_id) == dict(
+    assert counters(result(task_id)) == dict(
         errors=0,
         created=count, 
         updated=0,
@@ -74,3 +71,294 @@ def test_azure_sync_resource_create(
     assert ResourceEventChange.objects.filter(
         action=constants.EventChangeType.CREATE).count() == count + 1 # ResourceGroup
 
+
+@patch("requests.Session.get")
+@patch("mce_azure.core.get_resource_by_id")
+@patch("mce_tasks_djq.azure.get_subscription_and_session")
+def test_azure_sync_resource_update(
+    get_subscription_and_session,
+    get_resource_by_id,
+    session_get,
+    mock_response_class,
+    json_file, 
+    subscription,
+    resource_group,
+    broker,
+    require_resource_types):
+    """Unchanged resources are not written, changed resources are bulk updated"""
+
+    data_resource_list = json_file("resource-list.json")
+    data_resource = json_file("resource-vm.json")
+
+    get_subscription_and_session.return_value = (subscription, requests.Session())
+    session_get.return_value = mock_response_class(200, data_resource_list)
+    get_resource_by_id.return_value = data_resource
+
+    task_id = async_task('mce_tasks_djq.azure.sync_resource', subscription.pk, broker=broker, sync=True)
+    assert counters(result(task_id)) == dict(errors=0, created=1, updated=0, deleted=0)
+
+    # Unchanged
+    task_id = async_task('mce_tasks_djq.azure.sync_resource', subscription.pk, broker=broker, sync=True)
+    assert counters(result(task_id)) == dict(errors=0, created=0, updated=0, deleted=0)
+
+    # Update one
+    data_resource['properties']['hardwareProfile']['vmSize'] = "Standard_D4s_v3"
+    get_resource_by_id.return_value = data_resource
+
+    task_id = async_task('mce_tasks_djq.azure.sync_resource', subscription.pk, broker=broker, sync=True)
+    task = fetch(task_id)
+    assert task.success is True, result(task_id)
+    assert counters(result(task_id)) == dict(errors=0, created=0, updated=1, deleted=0)
+
+    assert ResourceAzure.objects.get().metas['hardwareProfile']['vmSize'] == "Standard_D4s_v3"
+    assert ResourceEventChange.objects.filter(
+        action=constants.EventChangeType.UPDATE).count() == 1
+
+@patch("requests.Session.get")
+@patch("mce_azure.core.get_resource_by_id")
+@patch("mce_tasks_djq.azure.get_subscription_and_session")
+def test_azure_sync_resource_group_not_found(
+    get_subscription_and_session,
+    get_resource_by_id,
+    session_get,
+    mock_response_class,
+    json_file, 
+    subscription,
+    broker,
+    require_resource_types):
+    """Resources are bypassed when their group is not in the subscription"""
+
+    data_resource_list = json_file("resource-list.json")
+
+    get_subscription_and_session.return_value = (subscription, requests.Session())
+    session_get.return_value = mock_response_class(200, data_resource_list)
+
+    task_id = async_task('mce_tasks_djq.azure.sync_resource', subscription.pk, broker=broker, sync=True)
+    assert counters(result(task_id)) == dict(errors=1, created=0, updated=0, deleted=0)
+
+    get_resource_by_id.assert_not_called()
+    assert ResourceAzure.objects.count() == 0
+
+@patch("requests.Session.get")
+@patch("mce_azure.core.get_resource_by_id")
+@patch("mce_tasks_djq.azure.get_subscription_and_session")
+def test_azure_sync_resource_fanout(
+    get_subscription_and_session,
+    get_resource_by_id,
+    session_get,
+    mock_response_class,
+    json_file,
+    build_resources,
+    subscription,
+    resource_group,
+    broker,
+    require_resource_types):
+    """One task per chunk and a reducer for the counters and the delete phase"""
+
+    data_resource = json_file("resource-vm.json")
+    entries = build_resources(3)
+
+    get_subscription_and_session.return_value = (subscription, requests.Session())
+    session_get.return_value = mock_response_class(200, dict(value=entries))
+    get_resource_by_id.return_value = data_resource
+
+    task_id = async_task(
+        'mce_tasks_djq.azure.sync_resource_fanout', subscription.subscription_id,
+        chunk_size=2, broker=broker, sync=True)
+    task = fetch(task_id)
+    assert task.success is True, result(task_id)
+    assert result(task_id)['chunks'] == 2
+
+    chunks = Task.objects.filter(group=result(task_id)['group'])
+    assert chunks.count() == 2
+
+    reduce_task = Task.objects.get(func='mce_tasks_djq.azure.sync_resource_reduce')
+    assert reduce_task.success is True, reduce_task.result
+    assert reduce_task.result == dict(errors=0, created=3, updated=0, deleted=0)
+
+    assert ResourceAzure.objects.count() == 3
+
+def test_azure_sync_resource_reduce_incomplete(subscription, resource_group, require_resource_types):
+    """The delete phase is skipped if the ids of a chunk are missing"""
+
+    resource = ResourceAzure.objects.create(
+        resource_id=f"{resource_group.resource_id}/providers/Microsoft.Compute/virtualMachines/MY_VM",
+        name="MY_VM",
+        company=resource_group.company,
+        resource_type=require_resource_types,
+        subscription=subscription,
+        resource_group=resource_group,
+        provider=constants.Provider.AZURE,
+        location="francecentral",
+        metas={},
+    )
+
+    # chunk 0 : ids et compteurs, chunk 1 : ids perdus (éviction, autre cache)
+    cache.set(azure._fanout_key("g1", 0, 'ids'), [id_key("/subscriptions/xxx/other")])
+    cache.set(azure._fanout_key("g1", 0, 'counters'), dict(errors=0, created=1, updated=0))
+
+    counters = azure.sync_resource_reduce(subscription.subscription_id, "g1", 2)
+
+    assert counters == dict(errors=0, created=1, updated=0, deleted=0)
+    assert ResourceAzure.objects.filter(pk=resource.pk).exists()
+
+@patch("mce_tasks_djq.azure.get_subscription_and_session")
+def test_azure_sync_resource_pages(
+    get_subscription_and_session,
+    settings,
+    fake_arm,
+    build_resources,
+    subscription,
+    resource_group,
+    broker,
+    require_resource_types):
+    """The listing is consumed page by page (nextLink)"""
+
+    server = fake_arm(resources=build_resources(5), page_size=2)
+    settings.MCE_ARM_URL = server.url
+
+    get_subscription_and_session.return_value = (subscription, requests.Session())
+
+    with patch("mce_azure.core.get_resource_by_id", server.get_resource_by_id):
+        task_id = async_task('mce_tasks_djq.azure.sync_resource', subscription.subscription_id, broker=broker, sync=True)
+
+    task = fetch(task_id)
+    assert task.success is True, result(task_id)
+    assert counters(result(task_id)) == dict(errors=0, created=5, updated=0, deleted=0)
+    assert result(task_id)['memory']['peak_rss_mb'] > 0
+
+    metrics = result(task_id)['metrics']
+    assert metrics['counts']['resources'] == 5
+    assert {'listing', 'fetch', 'write', 'delete'} <= set(metrics['phases'])
+
+    # 3 pages + 5 details
+    assert server.requests == 8
+    assert ResourceAzure.objects.count() == 5
+
+@patch("requests.Session.get")
+@patch("mce_azure.core.get_resource_by_id")
+@patch("mce_tasks_djq.azure.get_subscription_and_session")
+def test_azure_sync_resource_delete(
+    get_subscription_and_session,
+    get_resource_by_id,
+    session_get,
+    settings,
+    mock_response_class,
+    json_file,
+    build_resources,
+    subscription,
+    resource_group,
+    broker,
+    require_resource_types):
+    """Delete by chunks and create DELETE events"""
+
+    settings.MCE_SYNC_DELETE_CHUNK_SIZE = 2
+
+    entries = build_resources(3)
+
+    get_subscription_and_session.return_value = (subscription, requests.Session())
+    get_resource_by_id.return_value = json_file("resource-vm.json")
+
+    session_get.return_value = mock_response_class(200, dict(value=entries))
+    task_id = async_task('mce_tasks_djq.azure.sync_resource', subscription.pk, broker=broker, sync=True)
+    assert counters(result(task_id)) == dict(errors=0, created=3, updated=0, deleted=0)
+
+    session_get.return_value = mock_response_class(200, dict(value=entries[:1]))
+    task_id = async_task('mce_tasks_djq.azure.sync_resource', subscription.pk, broker=broker, sync=True)
+    assert counters(result(task_id)) == dict(errors=0, created=0, updated=0, deleted=2)
+
+    assert ResourceEventChange.objects.filter(
+        action=constants.EventChangeType.DELETE).count() == 2
+    assert ResourceAzure.objects.count() == 1
+
+@patch("mce_tasks_djq.azure.get_subscription_and_session")
+def test_azure_sync_resource_batch(
+    get_subscription_and_session,
+    settings,
+    fake_arm,
+    build_resources,
+    subscription,
+    resource_group,
+    broker,
+    require_resource_types):
+    """MCE_FETCH_BATCH_SIZE: the details are read with ARM $batch requests"""
+
+    settings.MCE_FETCH_BATCH_SIZE = 20
+
+    server = fake_arm(resources=build_resources(30), page_size=100)
+    settings.MCE_ARM_URL = server.url
+
+    get_subscription_and_session.return_value = (subscription, requests.Session())
+
+    with patch("mce_azure.core.get_resource_by_id", server.get_resource_by_id):
+        task_id = async_task('mce_tasks_djq.azure.sync_resource', subscription.subscription_id, broker=broker, sync=True)
+
+    assert counters(result(task_id)) == dict(errors=0, created=30, updated=0, deleted=0)
+
+    # 1 page + 2 batch au lieu de 1 page + 30 détails
+    assert server.batch_requests == 2
+    assert server.requests == 3
+    assert ResourceAzure.objects.count() == 30
+
+@patch("mce_tasks_djq.azure.get_subscription_and_session")
+def test_azure_sync_resource_shard(
+    get_subscription_and_session,
+    settings,
+    fake_arm,
+    build_resources,
+    subscription,
+    resource_group,
+    broker,
+    require_resource_types):
+    """One task per resource group - the delete phase is limited to the group"""
+
+    other = ResourceGroupAzure.objects.create(
+        resource_id=resource_group.resource_id.replace("MY_RG", "OTHER_RG"),
+        name="OTHER_RG",
+        company=resource_group.company,
+        resource_type=resource_group.resource_type,
+        subscription=subscription,
+        provider=constants.Provider.AZURE,
+        location="francecentral",
+    )
+
+    resources = build_resources(2) + build_resources(2)
+    for resource in resources[2:]:
+        resource['id'] = resource['id'].replace("/resourceGroups/MY_RG/", "/resourceGroups/OTHER_RG/")
+
+    server = fake_arm(resources=resources, page_size=100)
+    settings.MCE_ARM_URL = server.url
+
+    get_subscription_and_session.return_value = (subscription, requests.Session())
+
+    with patch("mce_azure.core.get_resource_by_id", server.get_resource_by_id):
+        task_id = async_task(
+            'mce_tasks_djq.azure.sync_resource_shard', subscription.subscription_id, resource_group.resource_id,
+            broker=broker, sync=True
+        )
+        assert counters(result(task_id)) == dict(errors=0, created=2, updated=0, deleted=0)
+        assert result(task_id)['resource_group'] == resource_group.resource_id
+
+        task_id = async_task(
+            'mce_tasks_djq.azure.sync_resource_shard', subscription.subscription_id, other.resource_id,
+            broker=broker, sync=True
+        )
+        assert counters(result(task_id)) == dict(errors=0, created=2, updated=0, deleted=0)
+
+        # une ressource de MY_RG disparait: OTHER_RG n'est pas concerné
+        del server.resources[resources[0]['id'].lower()]
+
+        task_id = async_task(
+            'mce_tasks_djq.azure.sync_resource_shard', subscription.subscription_id, other.resource_id,
+            broker=broker, sync=True
+        )
+        assert counters(result(task_id)) == dict(errors=0, created=0, updated=0, deleted=0)
+
+        task_id = async_task(
+            'mce_tasks_djq.azure.sync_resource_shard', subscription.subscription_id, resource_group.resource_id,
+            broker=broker, sync=True
+        )
+        assert counters(result(task_id)) == dict(errors=0, created=0, updated=0, deleted=1)
+
+    assert ResourceAzure.objects.filter(resource_group=resource_group).count() == 1
+    assert ResourceAzure.objects.filter(resource_group=other).count() == 2
@@ -9,6 +9,8 @@ from mce_django_app.models.common import ResourceEventChange
 from mce_django_app.models.azure import ResourceGroupAzure
 from mce_django_app import constants
 
+from tests.utils import counters
+
 pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
 
 @patch("mce_tasks_djq.azure.get_subscription_and_session")
@@ -34,7 +36,7 @@ def test_azure_sync_resource_group_create(
 
     task = fetch(task_id)
     assert task.success is True, result(task_id)
-    assert result(task_id) == dict(
+    assert counters(result(task_id)) == dict(
         errors=0,
         created=count_groups, 
         updated=0,
@@ -69,7 +71,7 @@ def test_azure_sync_resource_group_update(
         broker=broker, sync=True)
     task = fetch(task_id)
     assert task.success is True, result(task_id)
-    assert result(task_id) == dict(
+    assert counters(result(task_id)) == dict(
         errors=0,
         created=2, 
         updated=0,
@@ -89,7 +91,7 @@ def test_azure_sync_resource_group_update(
 
     task = fetch(task_id)
     assert task.success is True, result(task_id)
-    assert result(task_id) == dict(
+    assert counters(result(task_id)) == dict(
         errors=0,
         created=0, 
         updated=1,
@@ -120,7 +122,7 @@ def test_azure_sync_resource_group_delete(
         broker=broker, sync=True)
     task = fetch(task_id)
     assert task.success is True, result(task_id)
-    assert result(task_id) == dict(
+    assert counters(result(task_id)) == dict(
         errors=0,
         created=2, 
         updated=0,
@@ -139,7 +141,7 @@ def test_azure_sync_resource_group_delete(
 
     task = fetch(task_id)
     assert task.success is True, result(task_id)
-    assert result(task_id) == dict(
+    assert counters(result(task_id)) == dict(
         errors=0,
         created=0, 
         updated=0,
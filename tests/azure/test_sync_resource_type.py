@@ -3,6 +3,7 @@ import pytest
 from django_q.tasks import fetch, async_task, result
 
 from mce_django_app.models.common import ResourceType
+from mce_django_app import constants
 
 from mce_tasks_djq.azure import PROVIDERS
 
@@ -26,6 +27,7 @@ def test_azure_sync_resource_type(broker):
 
     assert ResourceType.objects.count() == count_type
 
+    # PROVIDERS unchanged
     task = async_task(
         'mce_tasks_djq.azure.sync_resource_type', 
         broker=broker, sync=True)
@@ -33,6 +35,28 @@ def test_azure_sync_resource_type(broker):
     assert result(task) == dict(
         errors=0,
         created=0, 
-        updated=count_type,
+        updated=0,
         deleted=0
     )
+
+def test_azure_sync_resource_type_changes(broker):
+    """Only the missing and modified rows are written"""
+
+    count_type = len(PROVIDERS)
+    names = sorted(PROVIDERS)
+
+    ResourceType.objects.create(name=names[0], provider=constants.Provider.AZURE)
+    ResourceType.objects.create(name=names[1], provider=constants.Provider.AWS)
+
+    task = async_task(
+        'mce_tasks_djq.azure.sync_resource_type', 
+        broker=broker, sync=True)
+
+    assert result(task) == dict(
+        errors=0,
+        created=count_type - 2, 
+        updated=1,
+        deleted=0
+    )
+
+    assert ResourceType.objects.filter(provider=constants.Provider.AZURE).count() == count_type
@@ -0,0 +1,56 @@
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mce_django_app.models.common import Tag
+from mce_django_app.models.azure import ResourceGroupAzure
+from mce_django_app import constants
+
+from mce_tasks_djq.bulk import BulkUpsert
+from mce_tasks_djq.tags import TagIndex
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+def test_tag_index():
+
+    Tag.objects.create(name="env", value="prod", provider=constants.Provider.AZURE)
+
+    index = TagIndex()
+    with CaptureQueriesContext(connection) as ctx:
+        index.intern([dict(env="prod", app="a1"), dict(env="dev", app="a1")])
+    # load + bulk_create + relecture des pk
+    assert len(ctx.captured_queries) == 3
+    assert index.created == 2
+
+    # même nom, valeurs différentes: un tag par (name, value)
+    assert sorted(Tag.objects.filter(name="env").values_list('value', flat=True)) == ["dev", "prod"]
+
+    with CaptureQueriesContext(connection) as ctx:
+        index.intern([dict(env="prod"), dict(app="a1")])
+        tags = index.get(dict(env="dev", app="a1"))
+    assert len(ctx.captured_queries) == 0
+    assert sorted((tag.name, tag.value) for tag in tags) == [("app", "a1"), ("env", "dev")]
+
+def test_bulk_upsert_tags(resource_group):
+
+    def _sync(tags):
+        upsert = BulkUpsert(ResourceGroupAzure, ResourceGroupAzure.objects.all())
+        upsert.load()
+        upsert.add(resource_group.resource_id, dict(name=resource_group.name), tags=tags)
+        with CaptureQueriesContext(connection) as ctx:
+            upsert.flush()
+        return upsert, len(ctx.captured_queries)
+
+    upsert, _ = _sync(dict(a="1", b="2"))
+    assert upsert.updated == 1
+    assert sorted(resource_group.tags.values_list('name', 'value')) == [("a", "1"), ("b", "2")]
+
+    upsert, _ = _sync(dict(a="1", b="3", c="4"))
+    assert upsert.updated == 1
+    assert sorted(resource_group.tags.values_list('name', 'value')) == [("a", "1"), ("b", "3"), ("c", "4")]
+
+    # tags inchangés: aucune requête
+    upsert, queries = _sync(dict(a="1", b="3", c="4"))
+    assert upsert.unchanged == 1
+    assert queries == 0
@@ -0,0 +1,80 @@
+import time
+
+import requests
+
+from mce_tasks_djq.fetch import configure_session, fetch_resources
+from mce_tasks_djq.throttle import Throttle, ThrottledAdapter, get_throttle
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+
+def _resource(i):
+    resource_id = f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/MY_RG/providers/Microsoft.Compute/virtualMachines/VM{i}"
+    return dict(id=resource_id, name=f"VM{i}", type="Microsoft.Compute/virtualMachines")
+
+def test_throttle_aimd(settings):
+
+    settings.MCE_THROTTLE_LOW_REMAINING = 100
+
+    throttle = Throttle("test", max_limit=8)
+    assert throttle.limit == 8
+
+    throttle.on_throttled(0)
+    throttle.on_throttled(0)
+    assert throttle.limit == 2
+    assert throttle.throttled == 2
+
+    # peu de lectures restantes: pas d'augmentation
+    throttle.on_success(remaining=10)
+    assert throttle.limit == 2
+
+    for i in range(4):
+        throttle.on_success(remaining=1000)
+    assert 3 <= throttle.limit < 4
+
+    for i in range(100):
+        throttle.on_success()
+    assert throttle.limit == 8
+
+def test_throttle_retry_after():
+
+    throttle = Throttle("test", max_limit=2)
+    throttle.on_throttled(0.2)
+
+    started = time.monotonic()
+    throttle.acquire()
+    throttle.release()
+    assert time.monotonic() - started >= 0.2
+
+def test_configure_session(settings):
+
+    session = configure_session(requests.Session(), 4, tenant="tenant1")
+    adapter = session.get_adapter('https://')
+    assert isinstance(adapter, ThrottledAdapter)
+    assert adapter.tenant == "tenant1"
+
+    # adapter conservé
+    configure_session(session, 4)
+    assert session.get_adapter('https://') is adapter
+
+    settings.MCE_THROTTLE = False
+    configure_session(session, 4)
+    assert not isinstance(session.get_adapter('https://'), ThrottledAdapter)
+
+def test_fetch_resources_throttled(settings, fake_arm):
+    """The 429 are retried after Retry-After - no resource is lost"""
+
+    resources = [_resource(i) for i in range(12)]
+    server = fake_arm(resources=resources, throttle=5)
+
+    session = configure_session(requests.Session(), 4, tenant="tenant1")
+    results = list(fetch_resources(
+        [(r['id'], i) for i, r in enumerate(resources)], session,
+        fetch=server.get_resource_by_id, concurrency=4,
+    ))
+
+    assert [error for _, _, _, error in results] == [None] * 12
+    assert server.throttled > 0
+
+    throttle = get_throttle('subscription', SUBSCRIPTION_ID)
+    assert throttle.throttled > 0
+    assert get_throttle('tenant', "tenant1").throttled == throttle.throttled
@@ -0,0 +1,49 @@
+import pytest
+
+from mce_django_app.models.common import Tag
+from mce_django_app import constants
+
+from mce_tasks_djq.metrics import SyncMetrics
+from mce_tasks_djq.transactions import ChunkedAtomic
+
+pytestmark = pytest.mark.django_db(transaction=True, reset_sequences=True)
+
+def _create_tags(chunks, count, fail_at=None):
+    for i in range(count):
+        chunks.step()
+        if i == fail_at:
+            raise ValueError("fail")
+        Tag.objects.create(name=f"tag{i}", value="v", provider=constants.Provider.AZURE)
+
+def test_chunked_atomic_commit():
+
+    metrics = SyncMetrics()
+    flushed = []
+
+    with ChunkedAtomic(size=2, before_commit=lambda: flushed.append(1), metrics=metrics) as chunks:
+        _create_tags(chunks, 5)
+
+    assert Tag.objects.count() == 5
+    assert chunks.commits == 3
+    assert len(flushed) == 3
+    datas = metrics.to_dict()
+    assert datas['counts']['commits'] == 3
+    assert 'commit' in datas['phases']
+
+def test_chunked_atomic_rollback_current_chunk():
+
+    with pytest.raises(ValueError):
+        with ChunkedAtomic(size=2) as chunks:
+            _create_tags(chunks, 5, fail_at=3)
+
+    # tag0 et tag1 commités, tag2 annulé avec le chunk en erreur
+    assert list(Tag.objects.order_by('name').values_list('name', flat=True)) == ['tag0', 'tag1']
+
+def test_chunked_atomic_autocommit():
+
+    with pytest.raises(ValueError):
+        with ChunkedAtomic(size=0) as chunks:
+            _create_tags(chunks, 5, fail_at=3)
+
+    assert Tag.objects.count() == 3
+    assert chunks.commits == 0
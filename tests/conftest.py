@@ -3,8 +3,14 @@ import json
 
 import pytest
 
+from django.core.cache import cache
 from django_q.brokers import get_broker
 
+from mce_tasks_djq import sessions, throttle
+from mce_tasks_djq.resolvers import resource_type_resolver
+
+from tests.fake_arm import FakeArmServer
+
 pytest_plugins = "mce_django_app.pytest.plugin"
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -14,6 +20,13 @@ FIXTURES_DIR = os.path.join(CURRENT_DIR, 'fixtures')
 def enable_db_access_for_all_tests(db):
     pass
 
+@pytest.fixture(autouse=True)
+def reset_caches():
+    cache.clear()
+    resource_type_resolver.clear()
+    sessions.clear()
+    throttle.clear()
+
 @pytest.fixture(autouse=True)
 def set_default_lang(settings):
     settings.LANGUAGE_CODE = 'en'
@@ -36,6 +49,22 @@ def json_file(fixtures_dir):
 
     return _loader
 
+@pytest.fixture
+def fake_arm():
+    """Start a local ARM server: fake_arm(resources=[...], latency=0.05)"""
+
+    servers = []
+
+    def _start(**kwargs):
+        server = FakeArmServer(**kwargs).start()
+        servers.append(server)
+        return server
+
+    yield _start
+
+    for server in servers:
+        server.stop()
+
 @pytest.fixture
 def broker():
     return get_broker()
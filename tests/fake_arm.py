@@ -0,0 +1,177 @@
+"""Local stand-in for the Azure Resource Manager REST API"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class FakeArmServer:
+    """In-process ARM endpoint
+
+    - GET /subscriptions/<id>/resources : listing paginated with nextLink
+    - GET /subscriptions/<id>/resourcegroups : listing paginated with nextLink
+    - GET /subscriptions/<id>/resourcegroups/<name>/resources : resources of one group
+    - GET <resource_id> : detail of one resource
+    - POST /batch : ARM $batch of GET requests
+
+    latency: seconds added to every request
+    throttle: max requests per second - beyond, 429 with a Retry-After header
+    batch_errors: resource ids answered with a 500 in a batch (but not alone)
+    batch_accepted: the batch responses are 202 + Location, then 200 on the Location
+    batch_stuck: with batch_accepted, the Location always answer 202
+    """
+
+    def __init__(self, resources=None, groups=None, latency=0.0, page_size=100, throttle=None,
+                 batch_errors=None, batch_accepted=False, batch_stuck=False):
+        self.resources = {r['id'].lower(): r for r in resources or []}
+        self.groups = list(groups or [])
+        self.latency = latency
+        self.page_size = page_size
+        self.throttle = throttle
+        self.batch_errors = {resource_id.lower() for resource_id in batch_errors or []}
+        self.batch_accepted = batch_accepted
+        self.batch_stuck = batch_stuck
+
+        self.requests = 0
+        self.batch_requests = 0
+        self._batch_results = {}
+        self.throttled = 0
+        self._window = (0, 0)
+        self.inflight = 0
+        self.max_inflight = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def get_resource_by_id(self, resource_id, session=None):
+        """Replacement of mce_azure.core.get_resource_by_id"""
+        response = session.get(f"{self.url}{resource_id}", params={'api-version': '2019-07-01'})
+        response.raise_for_status()
+        return response.json()
+
+    def _page(self, items, path, query):
+        skip = int(query.get('$skiptoken', ['0'])[0])
+        page = dict(value=items[skip:skip + self.page_size])
+        if skip + self.page_size < len(items):
+            page['nextLink'] = f"{self.url}{path}?$skiptoken={skip + self.page_size}"
+        return page
+
+    def _remaining(self):
+        """Requests left in the current second - call with the lock"""
+        second, count = self._window
+        now = int(time.monotonic())
+        if now != second:
+            second, count = now, 0
+        count += 1
+        self._window = (second, count)
+        return self.throttle - count
+
+    def handle_batch(self, body):
+        self.batch_requests += 1
+        responses = []
+        for request in body.get('requests', []):
+            url = urlsplit(request['url'])
+            if url.path.lower() in self.batch_errors:
+                status, content = 500, dict(error=dict(code='InternalServerError', message=url.path))
+            else:
+                status, content = self.handle(url.path, parse_qs(url.query))
+            responses.append(dict(name=request.get('name'), httpStatusCode=status, headers={}, content=content))
+
+        if not self.batch_accepted:
+            return 200, dict(responses=responses), {}
+
+        token = str(len(self._batch_results))
+        self._batch_results[token] = dict(responses=responses)
+        return 202, None, {'Location': f"{self.url}/batch/results/{token}", 'Retry-After': '0'}
+
+    def handle(self, path, query):
+        parts = path.lower().rstrip('/').split('/')
+        if len(parts) == 4 and parts[1:3] == ['batch', 'results']:
+            return 200, self._batch_results.pop(parts[3])
+        if len(parts) == 4 and parts[3] == 'resources':
+            return 200, self._page(list(self.resources.values()), path, query)
+        if len(parts) == 4 and parts[3] == 'resourcegroups':
+            return 200, self._page(self.groups, path, query)
+        if len(parts) == 6 and parts[3] == 'resourcegroups' and parts[5] == 'resources':
+            prefix = '/'.join(parts[:5]) + '/'
+            resources = [r for key, r in self.resources.items() if key.startswith(prefix)]
+            return 200, self._page(resources, path, query)
+        resource = self.resources.get(path.lower())
+        if resource is None:
+            return 404, dict(error=dict(code='ResourceNotFound', message=path))
+        return 200, resource
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                self._respond()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self._respond(json.loads(self.rfile.read(length) or b'{}'))
+
+            def _respond(self, post=None):
+                headers = {}
+                with server._lock:
+                    server.requests += 1
+                    server.inflight += 1
+                    server.max_inflight = max(server.max_inflight, server.inflight)
+                    remaining = server._remaining() if server.throttle else None
+                    if remaining is not None and remaining < 0:
+                        server.throttled += 1
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    if remaining is not None and remaining < 0:
+                        status, content = 429, dict(error=dict(code='TooManyRequests', message=self.path))
+                    elif post is not None and urlsplit(self.path).path == '/batch':
+                        status, content, headers = server.handle_batch(post)
+                    elif server.batch_stuck and urlsplit(self.path).path.startswith('/batch/results/'):
+                        status, content = 202, None
+                        headers = {'Location': f"{server.url}{self.path}", 'Retry-After': '0'}
+                    elif post is not None:
+                        status, content = 404, dict(error=dict(code='NotFound', message=self.path))
+                    else:
+                        url = urlsplit(self.path)
+                        status, content = server.handle(url.path, parse_qs(url.query))
+                    body = json.dumps(content).encode() if content is not None else b''
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    if remaining is not None:
+                        self.send_header('x-ms-ratelimit-remaining-subscription-reads', str(max(remaining, 0)))
+                        if remaining < 0:
+                            self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server.inflight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,4 @@
+
+def counters(task_result):
+    """Counters of a sync task result, without the metrics"""
+    return {k: task_result[k] for k in ('errors', 'created', 'updated', 'deleted') if k in task_result}